@@ -0,0 +1,197 @@
+""" Бенчмарк парсеров vpn серверов на локальных фикстурах
+
+    Каждая операция выполняется в отдельном процессе, поэтому пиковая
+    память (RSS) относится только к ней. Результаты сравниваются с
+    сохраненным базовым замером (bench/baseline.json).
+
+    $ python3 bench/bench.py                     # замер и сравнение с базовым
+    $ python3 bench/bench.py --save-baseline     # замер и сохранение базового
+    $ python3 bench/bench.py --check             # код возврата 1 при регрессии
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from argparse import ArgumentParser
+from statistics import quantiles
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from fixtures import (
+    FixtureServer, free_port, generate, point_sites,
+    VPNGATE_ROWS, FREEVPN_CONFIGS, IPSPEED_SERVERS
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+# Допустимое ухудшение пропускной способности и памяти относительно базового замера
+DEFAULT_TOLERANCE = 0.5
+# Количество повторов операций
+UPDATE_RUNS = 3
+TABLE_RUNS = 3
+CONFIG_RUNS = 1000
+
+SITES = {'vpngate': ('vpngate', 'VPNGate'), 'freevpn': ('freevpn', 'FreeVPN'),
+         'ipspeed': ('ipspeed', 'IPSpeedVPN')}
+
+class Result(NamedTuple):
+    """ Результат замера операции """
+    operation: str
+    samples: int
+    p50: float
+    p95: float
+    p99: float
+    # строк (update, table) или вызовов (get_config) в секунду
+    # по медианной длительности повтора
+    throughput: float
+    # пиковая память процесса (МБ)
+    peak_rss: float
+
+def _site(name: str, workfolder: str, base_url: str):
+    point_sites(base_url)
+    module, attr = SITES[name]
+    return getattr(__import__(module), attr)(workfolder)
+
+def _run_operation(name: str, operation: str, workfolder: str, base_url: str,
+                   runs: int, queue: multiprocessing.Queue) -> None:
+    """ Замер операции в дочернем процессе
+
+        Первый (прогревочный) вызов не учитывается: в нем импортируются
+        зависимости парсера. Для update каждый повтор выполняется в новой
+        директории, последняя из них остается для table и get_config
+    """
+    durations, units = [], 0
+    if operation == 'update':
+        for run in range(-1, runs):
+            folder = os.path.join(workfolder, f'run{run}')
+            shutil.rmtree(folder, ignore_errors=True)
+            os.makedirs(folder)
+            site = _site(name, folder, base_url)
+            start = time.perf_counter()
+            site.refresh()
+            if run >= 0:
+                durations.append(time.perf_counter() - start)
+                units += site.count()
+        shutil.rmtree(os.path.join(workfolder, 'last'), ignore_errors=True)
+        os.rename(folder, os.path.join(workfolder, 'last'))
+    else:
+        site = _site(name, os.path.join(workfolder, 'last'), base_url)
+        rng = random.Random(0)
+        count = site.count()
+        for run in range(-1, runs):
+            start = time.perf_counter()
+            if operation == 'table':
+                rows = sum(1 for _ in site.table().splitlines())
+            else:
+                site.get_config(rng.randint(1, count))
+                rows = 1
+            if run >= 0:
+                durations.append(time.perf_counter() - start)
+                units += rows
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((durations, units, peak_rss))
+
+def measure(name: str, operation: str, workfolder: str, base_url: str, runs: int) -> Result:
+    """ Замер операции сайта в отдельном процессе """
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_operation,
+                              args=(name, operation, workfolder, base_url, runs, queue))
+    process.start()
+    durations, units, peak_rss = queue.get()
+    process.join()
+
+    latencies = sorted(duration * 1000 for duration in durations)
+    if len(latencies) > 1:
+        cuts = quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0]
+    return Result(f'{name}.{operation}', len(latencies), p50, p95, p99,
+                  units / len(latencies) / max(p50 / 1000, 1e-9), peak_rss)
+
+def compare(results: List[Result], baseline: Dict[str, Dict[str, float]],
+            tolerance: float) -> List[Tuple[Result, Optional[float], bool]]:
+    """ Сравнение с базовым замером
+
+    Returns:
+        List[Tuple[Result, Optional[float], bool]]: результат, отношение
+            пропускной способности к базовой и признак регрессии
+    """
+    compared = []
+    for result in results:
+        base = baseline.get(result.operation)
+        if base is None:
+            compared.append((result, None, False))
+            continue
+        ratio = result.throughput / base['throughput']
+        regression = ratio < 1 - tolerance or result.peak_rss > base['peak_rss'] * (1 + tolerance)
+        compared.append((result, ratio, regression))
+    return compared
+
+def main() -> int:
+    parser = ArgumentParser(description='Offline benchmark of VPN site parsers')
+    parser.add_argument('--site', action='append', choices=list(SITES), default=None,
+                        help='Site to benchmark (default: all)')
+    parser.add_argument('--vpngate-rows', type=int, default=VPNGATE_ROWS)
+    parser.add_argument('--freevpn-configs', type=int, default=FREEVPN_CONFIGS)
+    parser.add_argument('--ipspeed-servers', type=int, default=IPSPEED_SERVERS)
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed throughput drop and RSS growth (fraction)')
+    parser.add_argument('--check', action='store_true',
+                        help='Exit with code 1 on a regression against the baseline')
+    ns = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='vpnmgr-bench-')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    try:
+        fixtures = generate(os.path.join(root, 'www'), base_url, ns.vpngate_rows,
+                            ns.freevpn_configs, ns.ipspeed_servers)
+        print(f'Fixtures: vpngate {fixtures.vpngate_rows} rows, freevpn {fixtures.freevpn_configs} '
+              f'configs, ipspeed {fixtures.ipspeed_links} links')
+
+        results = []
+        with FixtureServer(os.path.join(root, 'www'), port):
+            for name in ns.site or list(SITES):
+                workfolder = os.path.join(root, name)
+                os.makedirs(workfolder)
+                for operation, runs in (('update', UPDATE_RUNS), ('table', TABLE_RUNS),
+                                        ('get_config', CONFIG_RUNS)):
+                    results.append(measure(name, operation, workfolder, base_url, runs))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = {}
+    if os.path.isfile(ns.baseline):
+        with open(ns.baseline, 'r', encoding='utf8') as file:
+            baseline = json.load(file)
+
+    print(f'{"Operation":<20} {"N":>4} {"p50 (ms)":>9} {"p95 (ms)":>9} {"p99 (ms)":>9} '
+          f'{"Throughput/s":>13} {"RSS (MB)":>9} {"vs base":>8}')
+    failed = False
+    for result, ratio, regression in compare(results, baseline, ns.tolerance):
+        failed |= regression
+        versus = '-' if ratio is None else f'{ratio:.2f}x'
+        print(f'{result.operation:<20} {result.samples:>4} {result.p50:>9.2f} {result.p95:>9.2f} '
+              f'{result.p99:>9.2f} {result.throughput:>13.1f} {result.peak_rss:>9.1f} '
+              f'{versus:>8}{"  REGRESSION" if regression else ""}')
+
+    if ns.save_baseline:
+        baseline.update({result.operation: result._asdict() for result in results})
+        with open(ns.baseline, 'w', encoding='utf8') as file:
+            json.dump(baseline, file, indent=2)
+            file.write('\n')
+        print(f'Baseline saved: {ns.baseline}')
+
+    return 1 if ns.check and failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
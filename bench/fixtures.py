@@ -0,0 +1,196 @@
+""" Фикстуры сайтов с vpn серверами и локальный HTTP сервер для бенчмарков
+
+    Фикстуры повторяют формат ответов сайтов (API vpngate, страница и архив
+    freevpn, страница ipspeed со ссылками на ovpn-файлы) и масштабируются
+    до нужного количества vpn серверов
+"""
+import io
+import os
+import sys
+import time
+import base64
+import random
+import socket
+import zipfile
+import subprocess
+from typing import Iterator, List, NamedTuple, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# Размеры фикстур по умолчанию
+VPNGATE_ROWS = 10000
+FREEVPN_CONFIGS = 40
+IPSPEED_SERVERS = 150
+
+_VPNGATE_HEADER = ('#HostName,IP,Score,Ping,Speed,CountryLong,CountryShort,NumVpnSessions,'
+                   'Uptime,TotalUsers,TotalTraffic,LogType,Operator,Message,'
+                   'OpenVPN_ConfigData_Base64')
+_COUNTRIES = [('Japan', 'JP'), ('Korea Republic of', 'KR'), ('United States', 'US'),
+              ('Thailand', 'TH'), ('Russian Federation', 'RU'), ('Viet Nam', 'VN')]
+
+class Fixtures(NamedTuple):
+    """ Размеры сгенерированных фикстур """
+    vpngate_rows: int
+    freevpn_configs: int
+    ipspeed_links: int
+
+def site_keys(rng: random.Random) -> str:
+    """ Встроенные сертификаты и ключ, общие для ovpn-файлов одного сайта """
+    def pem(name: str, size: int) -> str:
+        body = base64.encodebytes(rng.randbytes(size)).decode('ascii')
+        return f'<{name}>\n-----BEGIN {name.upper()}-----\n{body}-----END {name.upper()}-----\n</{name}>\n'
+
+    return pem('ca', 1400) + pem('cert', 1000) + pem('key', 900)
+
+def ovpn_config(keys: str, host: str, port: int, proto: str) -> bytes:
+    """ ovpn-файл, по структуре и размеру близкий к файлам сайтов:
+        директивы и встроенные сертификаты и ключ сайта
+    """
+    return (f'client\ndev tun\nproto {proto}\nremote {host} {port}\n'
+            'cipher AES-128-CBC\nauth SHA1\nresolv-retry infinite\nnobind\n'
+            'persist-key\npersist-tun\nverb 3\n' + keys).encode('ascii')
+
+def write_vpngate(path: str, rows: int, rng: random.Random) -> None:
+    """ Ответ API vpngate: CSV с конфигурациями в base64 """
+    with open(path, 'w', encoding='utf8', newline='') as file:
+        file.write('*vpn_servers\r\n' + _VPNGATE_HEADER + '\r\n')
+        keys = site_keys(rng)
+        for i in range(rows):
+            ip = f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+            country, short = _COUNTRIES[i % len(_COUNTRIES)]
+            proto, port = ('udp', 1194 + i % 3) if i % 2 else ('tcp', 443)
+            config = base64.b64encode(ovpn_config(keys, ip, port, proto)).decode('ascii')
+            file.write(f'vpn{i},{ip},{rng.randint(1000, 900000)},{rng.randint(1, 300)},'
+                       f'{rng.randint(10 ** 5, 10 ** 9)},{country},{short},{rng.randint(0, 50)},'
+                       f'{rng.randint(10 ** 5, 10 ** 10)},{rng.randint(0, 10 ** 5)},'
+                       f'{rng.randint(0, 10 ** 12)},2weeks,op{i},,{config}\r\n')
+        file.write('*\r\n')
+
+def freevpn_page(base_url: str, rng: random.Random, features: int = 16) -> str:
+    """ Страница freevpn: пункты списка, имя, пароль и ссылка на архив
+
+    Args:
+        features (int): количество пунктов списка перед именем и паролем
+    """
+    items = ''.join(f'<li>Feature {i}</li>' for i in range(features))
+    return (f'<html><body><h1>Accounts</h1>'
+            f'<a class="maxbutton" href="{base_url}/files/FreeVPN.me-OpenVPN-Bundle.zip">Download</a>'
+            f'<ul>{items}<li><b>Username:</b> freevpn.me</li>'
+            f'<li><b>Password:</b> {rng.getrandbits(32):08x}</li></ul></body></html>')
+
+def write_freevpn(folder: str, base_url: str, configs: int, rng: random.Random) -> None:
+    """ Страница freevpn с именем, паролем и ссылкой на архив, и сам архив """
+    os.makedirs(os.path.join(folder, 'accounts'), exist_ok=True)
+    with open(os.path.join(folder, 'accounts', 'index.html'), 'w', encoding='utf8') as file:
+        file.write(freevpn_page(base_url, rng))
+
+    os.makedirs(os.path.join(folder, 'files'), exist_ok=True)
+    buffer = io.BytesIO()
+    keys = site_keys(rng)
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for i in range(configs):
+            proto, port = [('TCP', 80), ('TCP', 443), ('UDP', 53), ('UDP', 40000)][i % 4]
+            name = f'FreeVPN.me-OpenVPN-Bundle/Server{i}.FreeVPN.me-{proto}{port}.ovpn'
+            archive.writestr(name, ovpn_config(keys, f'server{i}.freevpn.me', port, proto.lower()))
+    with open(os.path.join(folder, 'files', 'FreeVPN.me-OpenVPN-Bundle.zip'), 'wb') as file:
+        file.write(buffer.getvalue())
+
+def _ipspeed_servers(servers: int) -> Iterator[Tuple[int, str, List[Tuple[str, int]]]]:
+    for i in range(servers):
+        yield i, f'172.16.{i >> 8 & 255}.{i & 255}', [('udp', 1194), ('tcp', 443)]
+
+def ipspeed_page(servers: int, rng: random.Random) -> str:
+    """ Страница ipspeed: таблица из ячеек div.list, две ссылки на сервер """
+    cells = ['<div class="list">Location</div>', '<div class="list">Download</div>',
+             '<div class="list">Uptime</div>', '<div class="list">Ping</div>']
+    for i, ip, endpoints in _ipspeed_servers(servers):
+        hrefs = ''.join(f'<a href="/ip/{ip}_{proto}_{port}.ovpn">{proto.upper()} {port}</a><br/>'
+                        for proto, port in endpoints)
+        country, _ = _COUNTRIES[i % len(_COUNTRIES)]
+        cells += [f'<div class="list">{country}</div>', f'<div class="list">{hrefs}</div>',
+                  f'<div class="list">{rng.randint(1, 30)} days</div>',
+                  f'<div class="list">{rng.randint(5, 300)} ms</div>']
+    return f'<html><body>{"".join(cells)}</body></html>'
+
+def write_ipspeed(folder: str, servers: int, rng: random.Random) -> int:
+    """ Страница ipspeed со ссылками на ovpn-файлы (две на сервер) и сами файлы
+
+    Returns:
+        int: количество ссылок
+    """
+    with open(os.path.join(folder, 'freevpn_openvpn.php'), 'w', encoding='utf8') as file:
+        file.write(ipspeed_page(servers, rng))
+    os.makedirs(os.path.join(folder, 'ip'), exist_ok=True)
+    keys = site_keys(rng)
+    links = 0
+    for _, ip, endpoints in _ipspeed_servers(servers):
+        for proto, port in endpoints:
+            with open(os.path.join(folder, 'ip', f'{ip}_{proto}_{port}.ovpn'), 'wb') as file:
+                file.write(ovpn_config(keys, ip, port, proto))
+            links += 1
+    return links
+
+def generate(folder: str, base_url: str, vpngate_rows: int = VPNGATE_ROWS,
+             freevpn_configs: int = FREEVPN_CONFIGS, ipspeed_servers: int = IPSPEED_SERVERS,
+             seed: int = 0) -> Fixtures:
+    """ Генерация фикстур всех сайтов в директорию, обслуживаемую сервером
+
+    Args:
+        folder (str): корень локального HTTP сервера
+        base_url (str): адрес сервера (ссылка на архив freevpn абсолютная)
+        seed (int): зерно генератора, фикстуры воспроизводимы
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(folder, 'api', 'iphone'), exist_ok=True)
+    write_vpngate(os.path.join(folder, 'api', 'iphone', 'index.html'), vpngate_rows, rng)
+    write_freevpn(folder, base_url, freevpn_configs, rng)
+    links = write_ipspeed(folder, ipspeed_servers, rng)
+    return Fixtures(vpngate_rows, freevpn_configs, links)
+
+def free_port() -> int:
+    """ Свободный TCP порт на localhost """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class FixtureServer:
+    """ Локальный HTTP сервер с фикстурами в отдельном процессе,
+        чтобы его память не учитывалась в измерениях
+    """
+    def __init__(self, folder: str, port: int) -> None:
+        self.folder = folder
+        self.port = port
+        self.base_url = f'http://127.0.0.1:{port}'
+        self._process = None
+
+    def __enter__(self) -> 'FixtureServer':
+        self._process = subprocess.Popen(
+            [sys.executable, '-m', 'http.server', str(self.port), '--bind', '127.0.0.1',
+             '--directory', self.folder],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(('127.0.0.1', self.port), timeout=1).close()
+                return self
+            except OSError:
+                if time.monotonic() > deadline or self._process.poll() is not None:
+                    self.__exit__(None, None, None)
+                    raise RuntimeError(f'fixture server did not start on port {self.port}')
+                time.sleep(0.05)
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._process.terminate()
+        self._process.wait()
+
+def point_sites(base_url: str) -> None:
+    """ Перенаправление парсеров сайтов на локальный сервер """
+    from vpngate import VPNGate
+    from freevpn import FreeVPN
+    from ipspeed import IPSpeedVPN
+
+    VPNGate._VPNGate__url = f'{base_url}/api/iphone/'
+    FreeVPN._FreeVPN__url = f'{base_url}/accounts/'
+    IPSpeedVPN._IPSpeedVPN__url = f'{base_url}/freevpn_openvpn.php'
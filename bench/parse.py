@@ -0,0 +1,91 @@
+""" Бенчмарк извлечения данных из страниц freevpn и ipspeed
+
+    Сравнивает движки vpnhtml с прежним разбором через полное дерево
+    BeautifulSoup (если bs4 установлен): время разбора и пиковый объем
+    памяти (tracemalloc) на страницах разного размера.
+
+    $ python3 bench/parse.py --ipspeed-servers 5000
+"""
+import sys
+import time
+import random
+import tracemalloc
+from argparse import ArgumentParser
+from importlib.util import find_spec
+from statistics import median
+from typing import Callable, Dict, List, Tuple
+
+from fixtures import freevpn_page, ipspeed_page
+from vpnhtml import available_engines, extract, labelled
+
+# Количество повторов каждого замера
+DEFAULT_RUNS = 5
+
+def _ipspeed_vpnhtml(engine: str) -> Callable[[str], int]:
+    def parse(page: str) -> int:
+        cells = extract(page, {'cells': 'div.list'}, engine)['cells']
+        return sum(len(cell.links) for cell in cells[5::4])
+    return parse
+
+def _freevpn_vpnhtml(engine: str) -> Callable[[str], int]:
+    def parse(page: str) -> int:
+        elements = extract(page, {'archive': 'a.maxbutton', 'account': 'li'}, engine)
+        return int(labelled(elements['account'], 'Username:') is not None)
+    return parse
+
+def _ipspeed_bs4(page: str) -> int:
+    from bs4 import BeautifulSoup
+
+    server_list = BeautifulSoup(page, 'html.parser').find_all('div', class_='list')
+    return sum(len(content.contents[::2]) for content in server_list[5::4])
+
+def _freevpn_bs4(page: str) -> int:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(page, 'html.parser')
+    soup.find('a', class_='maxbutton')
+    return int(len(soup.find_all('li')) > 17)
+
+def measure(parse: Callable[[str], int], page: str, runs: int) -> Tuple[float, float, int]:
+    """ Медианное время (мс), пиковая память (МБ) и результат разбора """
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = parse(page)
+        durations.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    parse(page)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return median(durations), peak / (1024 * 1024), result
+
+def main() -> int:
+    parser = ArgumentParser(description='HTML extraction benchmark for freevpn and ipspeed pages')
+    parser.add_argument('--ipspeed-servers', type=int, default=2000)
+    parser.add_argument('--freevpn-features', type=int, default=2000,
+                        help='List items before the account on the freevpn page')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS)
+    ns = parser.parse_args()
+
+    rng = random.Random(0)
+    pages = {'ipspeed': ipspeed_page(ns.ipspeed_servers, rng),
+             'freevpn': freevpn_page('http://127.0.0.1', rng, ns.freevpn_features)}
+    parsers: Dict[str, List[Tuple[str, Callable[[str], int]]]] = {
+        'ipspeed': [(engine, _ipspeed_vpnhtml(engine)) for engine in available_engines()],
+        'freevpn': [(engine, _freevpn_vpnhtml(engine)) for engine in available_engines()],
+    }
+    if find_spec('bs4') is not None:
+        parsers['ipspeed'].append(('bs4 tree', _ipspeed_bs4))
+        parsers['freevpn'].append(('bs4 tree', _freevpn_bs4))
+
+    print(f'{"Page":<8} {"Size (KB)":>9} {"Engine":<12} {"Parse (ms)":>10} {"Peak (MB)":>9} {"Result":>7}')
+    for page_name, page in pages.items():
+        for engine, parse in parsers[page_name]:
+            duration, peak, result = measure(parse, page, ns.runs)
+            print(f'{page_name:<8} {len(page) / 1024:>9.0f} {engine:<12} {duration:>10.1f} '
+                  f'{peak:>9.1f} {result:>7}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+""" Проверка времени запуска vpnmgr.py
+
+    Время импорта измеряется через "python -X importtime" для команд,
+    которым не нужна сеть. Проверка не проходит (код возврата 1), если
+    время импорта превышает бюджет или загружается тяжелая зависимость,
+    не нужная команде.
+
+    $ python3 bench/startup.py --budget 100
+"""
+import os
+import re
+import sys
+import shutil
+import tempfile
+import subprocess
+from argparse import ArgumentParser
+from typing import Dict, List, Tuple
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'src')
+# Бюджет времени импорта одной команды (мс)
+DEFAULT_BUDGET = 100.0
+# Количество запусков, учитывается лучший
+DEFAULT_RUNS = 5
+
+# Команды и модули, которые они не должны импортировать
+COMMANDS: List[Tuple[List[str], List[str]]] = [
+    (['--help'], ['requests', 'urllib3', 'bs4', 'asyncio', 'importlib.metadata',
+                  'socketserver', 'tarfile', 'vpngate', 'freevpn', 'ipspeed']),
+    (['--list', '--table', 'vpngate', '--limit', '1'], ['requests', 'urllib3', 'bs4', 'asyncio',
+                                                         'importlib.metadata', 'socketserver',
+                                                         'tarfile']),
+    (['connect', '--table', 'freevpn', '--index', '1'], ['requests', 'urllib3', 'bs4', 'asyncio',
+                                                         'importlib.metadata', 'socketserver',
+                                                         'tarfile']),
+]
+
+_LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+def import_times(args: List[str], cwd: str) -> Dict[str, int]:
+    """ Суммарное время импорта модулей верхнего уровня (мкс)
+
+    Args:
+        args (List[str]): аргументы интерпретатора
+        cwd (str): рабочая директория
+
+    Returns:
+        Dict[str, int]: время импорта по имени модуля; для модулей верхнего
+            уровня - с учетом вложенных импортов, для вложенных - 0
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', *args], cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        match = _LINE_RE.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        times[name] = cumulative if indent == 1 else times.get(name, 0)
+    return times
+
+def main() -> int:
+    parser = ArgumentParser(description='Startup time budget check for vpnmgr.py')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET,
+                        help='Import time budget per command in milliseconds')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS,
+                        help='Runs per command, the best one is reported')
+    ns = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='vpnmgr-startup-')
+    script = os.path.join(workdir, 'vpnmgr.py')
+    # копия исходников, чтобы не создавать ovpn.conf.d рядом с ними
+    for name in os.listdir(SRC_DIR):
+        if name.endswith('.py'):
+            shutil.copy(os.path.join(SRC_DIR, name), workdir)
+
+    failed = False
+    try:
+        # модули, которые интерпретатор загружает до запуска программы
+        startup = import_times(['-c', 'pass'], workdir)
+        print(f'{"Command":<48} {"Import (ms)":>11} {"Status":>7}')
+        for args, forbidden in COMMANDS:
+            best, modules = None, {}
+            for _ in range(max(1, ns.runs)):
+                modules = import_times([script, *args], workdir)
+                total = sum(time for name, time in modules.items()
+                            if name not in startup) / 1000
+                best = total if best is None else min(best, total)
+            loaded = [name for name in forbidden if name in modules]
+            ok = best <= ns.budget and not loaded
+            failed |= not ok
+            print(f'{" ".join(args):<48} {best:>11.1f} {"ok" if ok else "FAIL":>7}')
+            if loaded:
+                print(f'  unexpected imports: {", ".join(loaded)}')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+""" Заглушка openvpn для проверки vpnsupervisor без сети и прав root
+
+    Принимает аргументы "--config PATH", читает из ovpn-файла директиву
+    remote и ведет себя в зависимости от хоста:
+
+    - хост из STUB_OPENVPN_HANG - туннель не поднимается;
+    - хост из STUB_OPENVPN_DROP - туннель поднимается и через
+      STUB_OPENVPN_UPTIME секунд перезапускается (ping-restart);
+    - хост из STUB_OPENVPN_FAIL - процесс завершается с ошибкой;
+    - хост из STUB_OPENVPN_SLOW - туннель поднимается через
+      STUB_OPENVPN_SLOW_DELAY секунд;
+    - остальные - туннель поднимается через STUB_OPENVPN_DELAY секунд
+      и работает до SIGTERM.
+
+    Переменные окружения содержат хосты через запятую
+"""
+import os
+import sys
+import time
+import signal
+from argparse import ArgumentParser
+
+def log(message: str) -> None:
+    print(f'{time.strftime("%a %b %d %H:%M:%S %Y")} {message}', flush=True)
+
+def hosts(name: str) -> set:
+    return {host for host in os.environ.get(name, '').split(',') if host}
+
+def main() -> int:
+    parser = ArgumentParser()
+    parser.add_argument('--config', required=True)
+    ns = parser.parse_args()
+
+    remote = None
+    with open(ns.config, 'r', encoding='utf8', errors='replace') as file:
+        for line in file:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0] == 'remote':
+                remote = parts[1]
+                break
+
+    def terminate(signum, frame):
+        log(f'{signal.Signals(signum).name}[hard,] received, process exiting')
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+
+    log('OpenVPN 2.6.0 stub')
+    log(f'TCP/UDP: Preserving recently used remote address: [AF_INET]{remote}')
+    if remote in hosts('STUB_OPENVPN_FAIL'):
+        log('Exiting due to fatal error')
+        return 1
+    if remote in hosts('STUB_OPENVPN_HANG'):
+        while True:
+            time.sleep(1)
+            log('TLS Error: TLS key negotiation failed to occur within 60 seconds')
+
+    if remote in hosts('STUB_OPENVPN_SLOW'):
+        time.sleep(float(os.environ.get('STUB_OPENVPN_SLOW_DELAY', '2')))
+    else:
+        time.sleep(float(os.environ.get('STUB_OPENVPN_DELAY', '0.1')))
+    log('Initialization Sequence Completed')
+    if remote in hosts('STUB_OPENVPN_DROP'):
+        time.sleep(float(os.environ.get('STUB_OPENVPN_UPTIME', '0.2')))
+        log('[server] Inactivity timeout (--ping-restart), restarting')
+        log('SIGUSR1[soft,ping-restart] received, process restarting')
+    while True:
+        time.sleep(1)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,113 @@
+""" Проверка vpnsupervisor с заглушкой openvpn (bench/stub_openvpn.py)
+
+    Подключение проходит по очереди vpn серверы, которые не поднимают
+    туннель, теряют его и завершаются с ошибкой; проверяются причины
+    переключения, время до подключения и счетчики трассировщика.
+    Затем те же vpn серверы и медленный сервер подключаются гонкой
+    (--race): туннель должен подняться за время самого быстрого сервера.
+
+    $ python3 bench/supervisor.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+from typing import List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, os.pardir, 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+from vpnsupervisor import Supervisor
+from vpntrace import Tracer
+
+STUB = os.path.join(BENCH_DIR, 'stub_openvpn.py')
+# Задержка подключения заглушки (сек.)
+STUB_DELAY = 0.3
+
+def _config(folder: str, host: str) -> str:
+    path = os.path.join(folder, f'{host}.ovpn')
+    with open(path, 'w', encoding='utf8') as file:
+        file.write(f'client\ndev tun\nproto udp\nremote {host} 1194\n')
+    return path
+
+def main() -> int:
+    folder = tempfile.mkdtemp(prefix='vpnmgr-supervisor-')
+    os.environ.update({'STUB_OPENVPN_HANG': 'hang.example', 'STUB_OPENVPN_DROP': 'drop.example',
+                       'STUB_OPENVPN_FAIL': 'fail.example', 'STUB_OPENVPN_DELAY': str(STUB_DELAY),
+                       'STUB_OPENVPN_SLOW': 'slow.example', 'STUB_OPENVPN_SLOW_DELAY': '1',
+                       'STUB_OPENVPN_UPTIME': '0.2'})
+    failed = False
+    try:
+        # vpn сервер, ovpn-файл, ожидаемая причина переключения
+        cases: List[Tuple[str, str]] = [('hang.example', 'timeout'), ('none.example', 'no config'),
+                                        ('drop.example', 'dropped'), ('fail.example', 'exited')]
+        candidates = [(host, (lambda path=_config(folder, host): path)
+                       if reason != 'no config' else (lambda: None))
+                      for host, reason in cases]
+        tracer = Tracer(enabled=True)
+        supervisor = Supervisor(STUB, connect_timeout=1.5, attempts=len(cases),
+                                output=None, tracer=tracer)
+        attempts = supervisor.run(candidates)
+
+        print(f'{"Server":<14} {"Expected":<10} {"Reason":<10} {"Connect (s)":>11} {"Status":>7}')
+        for (host, expected), attempt in zip(cases, attempts):
+            ok = attempt.reason == expected
+            if expected == 'dropped':
+                ok = ok and attempt.time_to_connect is not None and \
+                    STUB_DELAY <= attempt.time_to_connect < STUB_DELAY + 1
+            failed |= not ok
+            connect = '-' if attempt.time_to_connect is None else f'{attempt.time_to_connect:.2f}'
+            print(f'{host:<14} {expected:<10} {attempt.reason:<10} {connect:>11} '
+                  f'{"ok" if ok else "FAIL":>7}')
+        failed |= len(attempts) != len(cases)
+
+        counters = tracer.snapshot()['counters']
+        expected_counters = {'connect_attempts': 3, 'failovers': 3}
+        print(f'Counters: {counters}')
+        failed |= any(counters.get(name) != value for name, value in expected_counters.items())
+        failed |= 'time_to_connect' not in tracer.snapshot()['spans']
+
+        missing = Supervisor(os.path.join(folder, 'missing-openvpn'), output=None)
+        attempts = missing.run(candidates)
+        print(f'Missing binary: {[attempt.reason for attempt in attempts]}')
+        failed |= [attempt.reason for attempt in attempts] != ['not started']
+
+        failed |= _race(folder)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    print('FAIL' if failed else 'OK')
+    return 1 if failed else 0
+
+def _race(folder: str) -> bool:
+    """ Гонка подключений: остается самый быстрый туннель
+
+    Returns:
+        bool: True - проверка не пройдена
+    """
+    expected = {'hang.example': 'cancelled', 'slow.example': 'cancelled',
+                'fail.example': 'exited', 'drop.example': 'dropped'}
+    candidates = [(host, lambda path=_config(folder, host): path) for host in expected]
+    tracer = Tracer(enabled=True)
+    supervisor = Supervisor(STUB, connect_timeout=1.5, attempts=1, output=None,
+                            tracer=tracer, race=len(expected))
+    start = time.monotonic()
+    attempts = supervisor.run(candidates)
+    elapsed = time.monotonic() - start
+
+    reasons = {attempt.label: attempt.reason for attempt in attempts}
+    connect = min((attempt.time_to_connect for attempt in attempts
+                   if attempt.time_to_connect is not None), default=None)
+    counters = tracer.snapshot()['counters']
+    print(f'Race: {reasons}')
+    print(f' Connected in {"-" if connect is None else f"{connect:.2f}"} s, '
+          f'total {elapsed:.2f} s, counters: {counters}')
+    # туннель drop.example поднимается раньше медленного сервера и теряется через
+    # STUB_OPENVPN_UPTIME, срок подключения зависшего сервера не ожидается
+    return reasons != expected or connect is None or connect >= 1 or elapsed >= 1.5 or \
+        counters != {'connect_attempts': len(expected)}
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,108 +1,161 @@
 #pylint: disable=invalid-name
 """ VPNGate """
 import os
-import csv
-import requests
-from urllib.request import urlretrieve
-from typing import List
+import hashlib
+import tempfile
+from urllib.parse import urljoin
+from typing import Deque, Iterator, List, Tuple
 from zipfile import ZipFile, ZipInfo
-from base64 import b64decode, b64encode
-from bs4 import BeautifulSoup
-from bs4.element import Tag
-from prettytable import PrettyTable
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from vpnabc import (
-    AbcSite, VPNFileNotFoundError
+    AbcSite, ListColumn, ServerMetrics, VPNDownloadError, VPNFileNotFoundError,
+    VPNNotModifiedError
 )
+from vpnstore import ServerStore
+from vpnconfcache import ConfigCache
+from vpnhttp import Fetcher, HTTPCache, DEFAULT_WORKERS
+from vpnhtml import extract, labelled
 
 class FreeVPN(AbcSite):
     """ Класс - парсер VPN серверов с сайта freevpn.me """
     __url = 'https://freevpn.me/accounts/'
-    __zip_name = 'freevpn.zip'
-    __csv_name = 'freevpn.csv'
-    __csv_delimeter = ','
-
-    def __init__(self, workfolder: str) -> None:
-        super().__init__(workfolder)
-        self.__csv_path = os.path.join(self._workfolder, self.__csv_name)
-        self.__zip_path = os.path.join(self._workfolder, self.__zip_name)
-
-    def table(self) -> str:
-        """ Получение таблицы vpn серверов
-
-        Raises:
-            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
-
-        Returns:
-            str: таблица vpn-серверов
+    __db_name = 'freevpn.db'
+    __cache_name = 'freevpn.cache.json'
+    __columns = ['username', 'password']
+    # тип соединения и порт - из директив ovpn-файла
+    _list_columns = AbcSite._list_columns + [
+        ListColumn('country', 'Country', "'Netherland'"),
+        ListColumn('username', 'Username', 'username'),
+        ListColumn('password', 'Password', 'password'),
+        ListColumn('type', 'Type', 'upper(proto)'),
+        ListColumn('port', 'Port', 'remote_port'),
+    ]
+    # селекторы страницы: ссылка на архив и пункты списка с именем и паролем
+    __selectors = {'archive': 'a.maxbutton', 'account': 'li'}
+    __username_label = 'Username:'
+    __password_label = 'Password:'
+    # размер архива, до которого он хранится только в памяти (байт)
+    __spool_size = 16 * 1024 * 1024
+
+    def __init__(self, workfolder: str, workers: int = DEFAULT_WORKERS) -> None:
+        super().__init__(workfolder, ServerStore(os.path.join(workfolder, self.__db_name),
+                                                 self.__columns))
+        self._http_cache = HTTPCache(os.path.join(self._workfolder, self.__cache_name))
+        self._config_cache = ConfigCache(self._workfolder, 'freevpn')
+        # количество потоков загрузки и распаковки архива
+        self.__workers = max(1, workers)
+        self.__fetcher = Fetcher(workers=workers, cache=self._http_cache,
+                                 cancel_event=self._cancel_event, tracer=self.tracer)
+
+    def metrics(self) -> Iterator[ServerMetrics]:
+        """ Показатели vpn серверов таблицы для ранжирования:
+            сайт публикует только адреса серверов
         """
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-
-        header = ['№', 'Country', 'Username', 'Password', 'Type', 'Port']
+        if not self._store.exists():
+            raise VPNFileNotFoundError(self._store.path)
 
-        table = PrettyTable(header)
-
-        with open(self.__csv_path, 'r') as file:
-            for i, items in enumerate(csv.reader(file, delimiter=self.__csv_delimeter)):
-                if i == 0:
-                    continue
-
-                table.add_row([i, 'Netherland'] + items[:-1])
-        return str(table)
+        for i, *_ in self._store.rows():
+            yield ServerMetrics(i, 'Netherland', None, None, None)
 
     def update(self) -> None:
         """ Обновление данных о vpn серверах """
         self._download()
 
     def _download(self) -> str:
-        # Скачивание zip файла с ovpn-файлами
-        page = requests.get(self.__url)
-        soup = BeautifulSoup(page.text, 'html.parser')
-        href = soup.find('a', class_='maxbutton').attrs['href']
-        urlretrieve(href, self.__zip_path)
-
-        # Парсинг имени, пароля ...
-        data: List[Tag] = soup.find_all('li')
-        vpn_username: str = data[16].contents[1][1:]
-        vpn_password: str = data[17].contents[1][1:]
-
-        # Распаковка zip архива
-        zip_file = ZipFile(self.__zip_path)
-        
-        with open(self.__csv_path, 'w', encoding='utf8') as file:
-            writer = csv.writer(file, delimiter=self.__csv_delimeter)
-            writer.writerow(['Username', 'Passsword', 'Type', 'Port', 'Config'])
-
-            for file in zip_file.filelist:
-                if file.is_dir():
-                    continue
-
-                if not file.filename.endswith(".ovpn"):
-                    continue
-
-                # содержимое файла конфигурации
-                ovpn_data = zip_file.open(file.filename).read()
-                base64_ovpn_data = b64encode(ovpn_data).decode('utf8')
-                # тип соединения и порт
-                vpn_type_port = file.filename.split('-')[-1].split('.')[0]
-                vpn_type = vpn_type_port[:3]
-                vpn_port = vpn_type_port[3:]
-
-                writer.writerow([vpn_username, vpn_password, vpn_type, vpn_port, base64_ovpn_data])
-    
-    def get_config(self, index: int) -> str:
-        """ Получение полного пути до ovpn-файла
-
-        Args:
-            index (int): индекс vpn сервера из таблицы
+        # Страница с аккаунтом и ссылкой на архив перепроверяется не чаще
+        # срока max_age; изменение определяется по хэшам страницы и архива
+        max_age = self._cache_max_age(self._store)
+        with self.tracer.span('fetch'):
+            page = self.__fetcher.get_if_modified(self.__url, max_age, conditional=False)
+        page_digest = hashlib.sha256(page.content).hexdigest()
+        page_same = max_age is not None and self._http_cache.is_same(self.__url, page_digest)
+
+        # Парсинг ссылки на архив, имени, пароля ...
+        with self.tracer.span('parse'):
+            elements = extract(page.text, self.__selectors)
+        hrefs = [element.attrs['href'] for element in elements['archive']
+                 if element.attrs.get('href')]
+        vpn_username = labelled(elements['account'], self.__username_label)
+        vpn_password = labelled(elements['account'], self.__password_label)
+        if not hrefs or vpn_username is None or vpn_password is None:
+            raise VPNDownloadError(f'Unexpected page layout: "{self.__url}"')
+        href = urljoin(self.__url, hrefs[0])
+
+        # Архив запрашивается условно, только если страница не изменилась:
+        # иначе нужно его содержимое для новых имени и пароля
+        try:
+            with self.tracer.span('fetch'):
+                zip_response = self.__fetcher.get_if_modified(
+                    href, 0 if page_same else None, stream=True)
+        except VPNNotModifiedError:
+            self._http_cache.hit(self.__url, page)
+            raise
+
+        # Потоковое скачивание zip файла с ovpn-файлами во временный буфер
+        zip_digest = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=self.__spool_size) as buffer:
+            with self.tracer.span('fetch'):
+                for chunk in self.__fetcher.iter_content(zip_response):
+                    zip_digest.update(chunk)
+                    buffer.write(chunk)
+
+            if page_same:
+                try:
+                    self._check_modified(self._store, href, zip_digest.hexdigest(), zip_response)
+                except VPNNotModifiedError:
+                    self._http_cache.hit(self.__url, page)
+                    raise
+
+            # Распаковка zip архива
+            with ZipFile(buffer) as zip_file, self._write_store(self._store) as writer:
+                members = [file for file in zip_file.infolist()
+                           if not file.is_dir() and file.filename.endswith('.ovpn')]
+                for _, ovpn_data in self._read_members(zip_file, members):
+                    self._check_cancelled()
+                    with self.tracer.span('write'):
+                        writer.add([vpn_username, vpn_password], ovpn_data)
+
+        self._http_cache.miss(self.__url, page, page_digest)
+        self._http_cache.miss(href, zip_response, zip_digest.hexdigest())
+
+    def _read_members(self, zip_file: ZipFile,
+                      members: List[ZipInfo]) -> Iterator[Tuple[ZipInfo, bytes]]:
+        """ Параллельная распаковка файлов конфигураций (zlib отпускает GIL)
+
+            Файлы возвращаются в порядке архива, распакованными заранее
+            хранится не больше двух файлов на поток
 
         Returns:
-            str: полный путь до ovpn-файла с конигурацией vpn сервера
+            Iterator[Tuple[ZipInfo, bytes]]: файл архива и его содержимое
+        """
+        with ThreadPoolExecutor(max_workers=self.__workers) as pool:
+            pending: Deque[Tuple[ZipInfo, Future]] = deque()
+            for file in members:
+                pending.append((file, pool.submit(self._read_member, zip_file, file)))
+                if len(pending) >= 2 * self.__workers:
+                    file, future = pending.popleft()
+                    yield file, future.result()
+            while pending:
+                file, future = pending.popleft()
+                yield file, future.result()
+
+    def _read_member(self, zip_file: ZipFile, file: ZipInfo) -> bytes:
+        """ Содержимое файла конфигурации из архива
+
+        Raises:
+            VPNUpdateCancelledError: обновление было прервано
         """
-        return self._decode_config(index)
+        self._check_cancelled()
+        with self.tracer.span('decode'), zip_file.open(file) as member:
+            return member.read()
 
-    def _decode_config(self, index: int) -> str:
-        """ Декодирование конфигурации заданного vpn сервера
+    def count(self) -> int:
+        """ Количество vpn серверов в таблице """
+        return self._store.count()
+
+    def get_config(self, index: int) -> str:
+        """ Получение полного пути до ovpn-файла
 
         Args:
             index (int): индекс vpn сервера из таблицы
@@ -114,24 +167,7 @@ class FreeVPN(AbcSite):
         Returns:
             str: полный путь до ovpn-файла с конигурацией vpn сервера
         """
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-
-        vpn_cfg_path = os.path.join(self._workfolder, f'freevpn-{str(index)}.ovpn')
-
-        with open(self.__csv_path, 'r') as file:
-            lines = file.readlines()
-
-            if not 0 < index < len(lines):
-                raise IndexError()
-
-            base64_data = lines[index].split(self.__csv_delimeter)[-1]
-            decode_data = b64decode(base64_data).decode('utf8')
-
-        with open(vpn_cfg_path, 'w') as file:
-            file.write(decode_data)
-
-        return vpn_cfg_path
+        return self._config_path(index)
 
 if __name__ == '__main__':
     fv = FreeVPN('./src/ovpn.conf.d')
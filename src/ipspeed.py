@@ -1,104 +1,130 @@
 #pylint: disable=invalid-name
 """ VPNGate """
 import os
-import csv
-import requests
-from urllib.request import urlretrieve
-from typing import List
-from zipfile import ZipFile, ZipInfo
-from base64 import b64decode, b64encode
-from bs4 import BeautifulSoup
-from bs4.element import Tag
-from prettytable import PrettyTable
+import re
+import hashlib
+from typing import Iterator, Optional
+from urllib.parse import urljoin
 from vpnabc import (
-    AbcSite, VPNFileNotFoundError
+    AbcSite, ListColumn, ServerMetrics, VPNFileNotFoundError, VPNDownloadError
 )
+from vpnstore import ServerStore
+from vpnconfcache import ConfigCache
+from vpnhttp import Fetcher, HTTPCache, DEFAULT_WORKERS
+from vpnhtml import extract
+
+# Множители единиц времени работы сервера (сек.)
+_UPTIME_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+def _parse_number(value: str) -> Optional[float]:
+    """ Первое число в строке ("35 ms" -> 35.0), None - числа нет """
+    match = re.search(r'\d+(?:\.\d+)?', value or '')
+    return float(match.group()) if match else None
+
+def _parse_uptime(value: str) -> Optional[float]:
+    """ Время работы в секундах из строки вида "2 days 5 hours" """
+    items = re.findall(r'(\d+(?:\.\d+)?)\s*([a-zA-Z]?)', value or '')
+    if not items:
+        return None
+    return sum(float(number) * _UPTIME_UNITS.get(unit[:1].lower(), 1) for number, unit in items)
 
 class IPSpeedVPN(AbcSite):
     """ Класс - парсер VPN серверов с сайта freevpn.me """
     __base_url = 'https://ipspeed.info'
     __url = f'{__base_url}/freevpn_openvpn.php'
-    __csv_name = 'ipspeedvpn.csv'
-    __csv_delimeter = ','
-
-    def __init__(self, workfolder: str) -> None:
-        super().__init__(workfolder)
-        self.__csv_path = os.path.join(self._workfolder, self.__csv_name)
-
-    def table(self) -> str:
-        """ Получение таблицы vpn серверов
-
-        Raises:
-            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
-
-        Returns:
-            str: таблица vpn-серверов
-        """
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-
-        header = ['№', 'Country', 'IP', 'Type', 'Port', 'Uptime', 'Ping']
-
-        table = PrettyTable(header)
-
-        with open(self.__csv_path, 'r') as file:
-            for i, items in enumerate(csv.reader(file, delimiter=self.__csv_delimeter)):
-                if i == 0:
-                    continue
-
-                table.add_row([i] + items[:-1])
-        return str(table)
+    __db_name = 'ipspeedvpn.db'
+    __cache_name = 'ipspeedvpn.cache.json'
+    __columns = ['country', 'uptime', 'ping']
+    # адрес, тип соединения и порт - из директив ovpn-файла
+    _list_columns = AbcSite._list_columns + [
+        ListColumn('country', 'Country', 'country'),
+        ListColumn('ip', 'IP', 'remote_host'),
+        ListColumn('type', 'Type', 'proto'),
+        ListColumn('port', 'Port', 'remote_port'),
+        ListColumn('uptime', 'Uptime', 'uptime'),
+        ListColumn('ping', 'Ping', 'ping'),
+    ]
+    # ячейки таблицы серверов на странице
+    __cells_selector = 'div.list'
+    # столбцы таблицы: страна, ссылки на ovpn-файлы, время работы, задержка
+    __grid = ('country', 'links', 'uptime', 'ping')
+    # допустимая доля нескачанных файлов конфигураций
+    __max_skipped_ratio = 0.1
+
+    def __init__(self, workfolder: str, workers: int = DEFAULT_WORKERS) -> None:
+        super().__init__(workfolder, ServerStore(os.path.join(workfolder, self.__db_name),
+                                                 self.__columns))
+        self._http_cache = HTTPCache(os.path.join(self._workfolder, self.__cache_name))
+        self._config_cache = ConfigCache(self._workfolder, 'ipspeed')
+        self.__fetcher = Fetcher(workers=workers, cache=self._http_cache,
+                                 cancel_event=self._cancel_event, tracer=self.tracer)
+
+    def metrics(self) -> Iterator[ServerMetrics]:
+        """ Показатели vpn серверов таблицы для ранжирования """
+        if not self._store.exists():
+            raise VPNFileNotFoundError(self._store.path)
+
+        for i, country, uptime, ping in self._store.rows():
+            yield ServerMetrics(i, country, None, _parse_number(ping), _parse_uptime(uptime))
 
     def update(self) -> None:
         """ Обновление данных о vpn серверах """
         self._download()
 
     def _download(self) -> str:
-        page = requests.get(self.__url)
-        soup = BeautifulSoup(page.text, 'html.parser')
-        server_list: List[Tag] = soup.find_all('div', class_='list')
-
-        # извлечение стран
-        countries_list = [content.contents[0] for content in server_list[4::4]]
-        # извлечение времени работы
-        uptime_list = [content.contents[0] for content in server_list[6::4]]
-        # извлечение задержки
-        ping_list = [content.contents[0] for content in server_list[7::4]]
-        # извлечение ссылок на скачивание файлов конфигураций
-        href_list = [[href.attrs['href'] for href in content.contents[::2]]
-                    for content in server_list[5::4]]
-        href_list = [[f'{self.__base_url}{href}' for href in contents] for contents in href_list]
-        
-        # скачивание файлов конфигураций
-        with open(self.__csv_path, 'w') as file:
-            writer = csv.writer(file, delimiter=self.__csv_delimeter)
-
-            for country, href, uptime, ping in \
-                zip(countries_list, href_list, uptime_list, ping_list):
-
-                for ref in href:
-                    ip, type, port = ref.split('_')
-                    port = port.split('.')[0]
-                    ip = ip.split('/')[-1]
-
-                    ovpn_page = requests.get(ref)
-                    base64_ovpn_data = b64encode(ovpn_page.text.encode('utf8'))
-
-                    writer.writerow([country, ip, type, port, uptime, ping, base64_ovpn_data])
-    
-    def get_config(self, index: int) -> str:
-        """ Получение полного пути до ovpn-файла
+        # если страница со списком серверов не изменилась,
+        # файлы конфигураций повторно не скачиваются
+        with self.tracer.span('fetch'):
+            page = self.__fetcher.get_if_modified(self.__url, self._cache_max_age(self._store))
+        digest = hashlib.sha256(page.content).hexdigest()
+        self._check_modified(self._store, self.__url, digest, page)
+
+        with self.tracer.span('parse'):
+            cells = extract(page.text, {'cells': self.__cells_selector})['cells']
+
+        # строки таблицы в порядке следования на странице; строка
+        # заголовка и строки без ссылок на конфигурации пропускаются
+        rows = []
+        for start in range(0, len(cells) - len(self.__grid) + 1, len(self.__grid)):
+            cell = dict(zip(self.__grid, cells[start:start + len(self.__grid)]))
+            for href in cell['links'].links:
+                rows.append((cell['country'].text, urljoin(self.__url, href),
+                             cell['uptime'].text, cell['ping'].text))
+        if not rows:
+            raise VPNDownloadError(f'Unexpected page layout: "{self.__url}"')
+
+        # параллельное скачивание файлов конфигураций,
+        # ответы возвращаются в порядке ссылок
+        with self.tracer.span('fetch'):
+            ovpn_pages = self.__fetcher.fetch_all(ref for _, ref, _, _ in rows)
+
+        self.skipped = [f'{ref}: {ovpn_page}' for (_, ref, _, _), ovpn_page in
+                        zip(rows, ovpn_pages) if isinstance(ovpn_page, Exception)]
+        # при большом количестве ошибок действующая таблица сохраняется
+        if len(self.skipped) > self.__max_skipped_ratio * len(rows):
+            raise VPNDownloadError(
+                f'{len(self.skipped)} of {len(rows)} config downloads failed')
+
+        with self._write_store(self._store) as writer:
+            for (country, _, uptime, ping), ovpn_page in zip(rows, ovpn_pages):
+                self._check_cancelled()
+                # конфигурацию скачать не удалось
+                if isinstance(ovpn_page, Exception):
+                    continue
 
-        Args:
-            index (int): индекс vpn сервера из таблицы
+                with self.tracer.span('write'):
+                    writer.add([country, uptime, ping], ovpn_page.text.encode('utf8'))
 
-        Returns:
-            str: полный путь до ovpn-файла с конигурацией vpn сервера
-        """
-        return self._decode_config(index)
+        # при пропущенных конфигурациях страница будет обработана повторно
+        if not self.skipped:
+            self._http_cache.miss(self.__url, page, digest)
+
+    def count(self) -> int:
+        """ Количество vpn серверов в таблице """
+        return self._store.count()
 
-    def _decode_config(self, index: int) -> str:
-        """ Декодирование конфигурации заданного vpn сервера
+    def get_config(self, index: int) -> str:
+        """ Получение полного пути до ovpn-файла
 
         Args:
             index (int): индекс vpn сервера из таблицы
@@ -110,24 +136,7 @@ class IPSpeedVPN(AbcSite):
         Returns:
             str: полный путь до ovpn-файла с конигурацией vpn сервера
         """
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-
-        vpn_cfg_path = os.path.join(self._workfolder, f'ipspeed-{str(index)}.ovpn')
-
-        with open(self.__csv_path, 'r') as file:
-            lines = file.readlines()
-
-            if not 0 < index < len(lines):
-                raise IndexError()
-
-            base64_data = lines[index].split(self.__csv_delimeter)[-1]
-            decode_data = b64decode(base64_data).decode('utf8')
-
-        with open(vpn_cfg_path, 'w') as file:
-            file.write(decode_data)
-
-        return vpn_cfg_path
+        return self._config_path(index)
 
 if __name__ == '__main__':
     fv = IPSpeedVPN('./src/ovpn.conf.d')
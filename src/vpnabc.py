@@ -1,4 +1,15 @@
+import os
+import time
+import tempfile
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+from vpnstore import ServerStore, StoreWriter
+from vpnhistory import ServerHistory, UpdateSummary, score_expr
+from vpnconfcache import ConfigCache
+from vpnlist import in_ranges, table_lines
+from vpntrace import Tracer
 
 class VPNError(Exception):
     pass
@@ -10,27 +21,156 @@ class VPNFileNotFoundError(VPNError):
         self._file_path = file_path
         super().__init__()
 
+class VPNUpdateCancelledError(VPNError):
+    """ Обновление списка vpn серверов прервано (истек срок обновления) """
+    def __init__(self, file_path: str) -> None:
+        self._message = f'VPN update cancelled: "{file_path}"'
+        self._file_path = file_path
+        super().__init__(self._message)
+
+class VPNDownloadError(VPNError):
+    """ Не удалось скачать данные vpn серверов сайта """
+    def __init__(self, message: str) -> None:
+        self._message = message
+        super().__init__(message)
+
+class VPNNotModifiedError(VPNError):
+    """ Данные сайта не изменились с предыдущего обновления """
+    def __init__(self, url: str) -> None:
+        self._message = f'VPN site not modified: "{url}"'
+        self._url = url
+        super().__init__(self._message)
+
+class VPNQueryError(VPNError):
+    """ Неверный запрос к таблице vpn серверов (столбец, фильтр) """
+    def __init__(self, message: str) -> None:
+        self._message = message
+        super().__init__(message)
+
+class ListColumn(NamedTuple):
+    """ Столбец вывода таблицы vpn серверов """
+    # имя столбца для фильтров и сортировки, ключ в JSON
+    key: str
+    # заголовок текстовой таблицы
+    header: str
+    # SQL выражение над столбцами хранилища
+    expr: str
+
+class ServerMetrics(NamedTuple):
+    """ Показатели vpn сервера, общие для всех сайтов """
+    # индекс vpn сервера в таблице
+    index: int
+    # страна (название или код)
+    country: str
+    # скорость (Мбит/с), None - неизвестна
+    speed: Optional[float]
+    # задержка, указанная на сайте (мс), None - неизвестна
+    ping: Optional[float]
+    # время работы (сек.), None - неизвестно
+    uptime: Optional[float]
+
 class AbcSite(ABC):
-    """ Интерфейс взаимодействия с сайтов vpn серверов """
-    def __init__(self, workfolder: str) -> None:
+    """ Интерфейс взаимодействия с сайтов vpn серверов
+
+        Каждый сайт хранит свои vpn серверы в хранилище (vpnstore.ServerStore),
+        которое передается в конструктор
+    """
+    # Столбцы вывода таблицы (--list), задаются каждым сайтом
+    _list_columns: List[ListColumn] = [ListColumn('index', '№', 'id')]
+    # Столбцы директив ovpn-файлов (vpnstore.DIRECTIVE_COLUMNS), доступные
+    # для фильтров, сортировки и выбора, но не выводимые по умолчанию
+    _directive_columns: List[ListColumn] = [
+        ListColumn('remote', 'Remote', 'remote_host'),
+        ListColumn('port', 'Port', 'remote_port'),
+        ListColumn('proto', 'Proto', 'proto'),
+        ListColumn('cipher', 'Cipher', 'cipher'),
+        ListColumn('auth', 'Auth', 'auth'),
+    ]
+    # Столбцы оценок по истории обновлений (vpnhistory), доступные так же,
+    # как столбцы директив; NULL - сервер еще не записан в историю
+    _history_columns: List[ListColumn] = [
+        ListColumn('stability', 'Stability', score_expr("printf('%.2f', stability)")),
+        ListColumn('availability', 'Availability (%)',
+                   score_expr("printf('%.1f', 100.0 * seen / tracked)")),
+        ListColumn('flaps', 'Flaps', score_expr('flaps')),
+    ]
+
+    def __init__(self, workfolder: str, store: ServerStore) -> None:
         self._workfolder = workfolder
+        # хранилище vpn серверов сайта
+        self._store = store
+        self._cancel_event = threading.Event()
+        # время (сек.), в течение которого данные сайта не перепроверяются
+        self._max_age: float = 0
+        # кэш HTTP ответов сайта (vpnhttp.HTTPCache), если он используется
+        self._http_cache = None
+        # кэш ovpn-файлов сайта, задается сайтом для _config_path()
+        self._config_cache: Optional[ConfigCache] = None
+        # пропущенные при последнем обновлении vpn серверы и причины пропуска
+        self.skipped: List[str] = []
+        # длительность этапов и счетчики сайта, включается флагом --metrics
+        self.tracer = Tracer()
 
-    @abstractmethod
     def table(self) -> str:
         """ Полеучение строки, в которой содержится таблица
             с vpn серверами.
 
             Пример:
-            Table: vpngate
             +---+---------+----+--------------+-----------+
             | № | Country | IP | Speed (Mb/s) | Ping (ms) |
             +---+---------+----+--------------+-----------+
             ...
             +---+---------+----+--------------+-----------+
 
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
         """
-        pass
-    
+        self._require_store()
+        header = [column.header for column in self._list_columns]
+        return '\n'.join(table_lines(header, self.select))
+
+    def list_columns(self) -> List[ListColumn]:
+        """ Столбцы вывода таблицы """
+        return list(self._list_columns)
+
+    def select(self, keys: Optional[Sequence[str]] = None,
+               filters: Sequence[Tuple[str, str, str]] = (),
+               sort: Optional[Tuple[str, bool]] = None,
+               limit: Optional[int] = None) -> Iterator[Tuple[Any, ...]]:
+        """ Строки таблицы без чтения конфигураций vpn серверов
+
+            Кроме столбцов вывода доступны столбцы директив ovpn-файлов
+            (remote, port, proto, cipher, auth) и оценки по истории обновлений
+            (stability, availability, flaps)
+
+        Args:
+            keys (Optional[Sequence[str]]): выводимые столбцы, по умолчанию - столбцы вывода
+            filters (Sequence[Tuple[str, str, str]]): столбец, оператор и значение
+            sort (Optional[Tuple[str, bool]]): столбец и признак сортировки по убыванию
+            limit (Optional[int]): максимальное количество строк
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+            VPNQueryError: неизвестный столбец
+
+        Returns:
+            Iterator[Tuple[Any, ...]]: значения выбранных столбцов
+        """
+        columns = {column.key: column for column in self._list_columns}
+        for column in self._directive_columns + self._history_columns:
+            columns.setdefault(column.key, column)
+
+        def expr(key: str) -> str:
+            if key not in columns:
+                raise VPNQueryError(f'Unknown column "{key}", available: {", ".join(columns)}')
+            return columns[key].expr
+
+        exprs = [expr(key) for key in keys] if keys else \
+            [column.expr for column in self._list_columns]
+        sql_filters = [(expr(key), op, value) for key, op, value in filters]
+        sql_sort = (expr(sort[0]), sort[1]) if sort is not None else None
+        return self._require_store().select(exprs, sql_filters, sql_sort, limit)
+
     @abstractmethod
     def update(self) -> None:
         """ Обновление списка vpn серверов """
@@ -43,4 +183,289 @@ class AbcSite(ABC):
         """
         pass
 
-    
\ No newline at end of file
+    @abstractmethod
+    def count(self) -> int:
+        """ Количество vpn серверов в таблице """
+        pass
+
+    @abstractmethod
+    def metrics(self) -> Iterator[ServerMetrics]:
+        """ Показатели vpn серверов таблицы для ранжирования """
+        pass
+
+    def load_in_memory(self) -> None:
+        """ Чтение таблицы из копии в памяти (режим службы), копия
+            обновляется после замены таблицы на диске
+        """
+        self._store.load_in_memory()
+
+    def _require_store(self) -> ServerStore:
+        """ Хранилище vpn серверов сайта
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+        """
+        if not self._store.exists():
+            raise VPNFileNotFoundError(self._store.path)
+        return self._store
+
+    def endpoints(self) -> Iterator[Tuple[int, str, int, str]]:
+        """ Адреса vpn серверов таблицы из столбцов директив, без чтения
+            ovpn-файлов
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+
+        Returns:
+            Iterator[Tuple[int, str, int, str]]: индекс, хост, порт и протокол
+        """
+        for index, host, port, proto in self._require_store().select(
+                ['id', 'remote_host', 'remote_port', 'proto']):
+            if host is not None:
+                yield index, host, port, proto
+
+    def configs(self, ranges: Sequence[Tuple[int, Optional[int]]] = (),
+                filters: Sequence[Tuple[str, str, str]] = ()) -> Iterator[Tuple[int, bytes]]:
+        """ Конфигурации vpn серверов за один проход по хранилищу,
+            без ranges и filters - все vpn серверы таблицы
+
+        Args:
+            ranges (Sequence[Tuple[int, Optional[int]]]): первый и последний индексы
+                диапазонов (vpnlist.parse_ranges), None - до конца таблицы
+            filters (Sequence[Tuple[str, str, str]]): столбец, оператор и значение,
+                как для select()
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+            VPNQueryError: неизвестный столбец фильтра
+
+        Returns:
+            Iterator[Tuple[int, bytes]]: индекс vpn сервера и содержимое ovpn-файла
+        """
+        store = self._require_store()
+        indexes = None
+        if ranges or filters:
+            # строки выбираются без чтения конфигураций
+            indexes = {index for index, in self.select(['index'], filters)
+                       if not ranges or in_ranges(index, ranges)}
+        return store.configs(indexes)
+
+    def _config_path(self, index: int) -> str:
+        """ Путь до ovpn-файла vpn сервера из кэша ovpn-файлов сайта:
+            файл записывается, только если его нет в кэше
+
+        Args:
+            index (int): индекс vpn сервера из таблицы
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+            IndexError: неверный индекс vpn сервера
+
+        Returns:
+            str: полный путь до ovpn-файла с конфигурацией vpn сервера
+        """
+        with self._require_store().reader() as reader:
+            digest = reader.digest(index)
+            path = self._config_cache.get(digest)
+            if path is not None:
+                self.tracer.count('config_cache_hits')
+                return path
+
+            self.tracer.count('config_cache_misses')
+            with self.tracer.span('decode'):
+                data = reader.config(index)
+        return self._config_cache.put(digest, data)
+
+    def save_probes(self, results: Iterable[Tuple[str, int, str, Optional[float]]]) -> None:
+        """ Сохранение измеренных задержек рядом с таблицей vpn серверов
+
+        Args:
+            results (Iterable[Tuple[str, int, str, Optional[float]]]): хост, порт,
+                протокол и задержка (мс), None - сервер недоступен
+        """
+        self._require_store().save_probes(results)
+
+    def probes(self, endpoints: Optional[Iterable[Tuple[int, str, int, str]]] = None
+               ) -> Dict[int, Optional[float]]:
+        """ Измеренные задержки vpn серверов таблицы
+
+        Args:
+            endpoints (Optional[Iterable[Tuple[int, str, int, str]]]): уже
+                прочитанные адреса vpn серверов, по умолчанию - endpoints()
+
+        Returns:
+            Dict[int, Optional[float]]: задержка (мс) по индексу vpn сервера,
+                None - сервер недоступен; непроверенные серверы отсутствуют
+        """
+        results = self._require_store().probes()
+        if endpoints is None:
+            endpoints = self.endpoints()
+        return {index: results[(host, port, proto)]
+                for index, host, port, proto in endpoints
+                if (host, port, proto) in results}
+
+    def stability(self, endpoints: Optional[Iterable[Tuple[int, str, int, str]]] = None
+                  ) -> Dict[int, float]:
+        """ Стабильность vpn серверов таблицы по истории обновлений
+
+        Args:
+            endpoints (Optional[Iterable[Tuple[int, str, int, str]]]): уже
+                прочитанные адреса vpn серверов, по умолчанию - endpoints()
+
+        Returns:
+            Dict[int, float]: стабильность (0..1) по индексу vpn сервера;
+                серверы, которых нет в истории, отсутствуют
+        """
+        scores = ServerHistory(self._require_store().history_path).scores()
+        if endpoints is None:
+            endpoints = self.endpoints()
+        return {index: scores[(host, port, proto)].stability
+                for index, host, port, proto in endpoints
+                if (host, port, proto) in scores}
+
+    def record_history(self) -> UpdateSummary:
+        """ Запись изменений таблицы в историю обновлений и пересчет оценок
+            vpn серверов
+
+        Raises:
+            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
+
+        Returns:
+            UpdateSummary: количество добавленных, исчезнувших и изменившихся серверов
+        """
+        store = self._require_store()
+        endpoints = {index: (host, port, proto) for index, host, port, proto in self.endpoints()}
+        servers = {endpoints[server.index]: server[1:] for server in self.metrics()
+                   if server.index in endpoints}
+        summary = ServerHistory(store.history_path).record(servers)
+        self.tracer.count('history_changes', sum(summary))
+        return summary
+
+    def refresh(self, max_age: float = 0) -> bool:
+        """ Обновление списка vpn серверов, которое может быть
+            прервано методом cancel()
+
+        Args:
+            max_age (float): время (сек.), в течение которого данные
+                сайта не перепроверяются
+
+        Returns:
+            bool: False - данные сайта не изменились, таблица не перезаписана
+        """
+        self._cancel_event.clear()
+        self._max_age = max_age
+        self.skipped = []
+        try:
+            with self.tracer.span('update'):
+                self.update()
+        except VPNNotModifiedError:
+            return False
+        finally:
+            if self._http_cache is not None:
+                self._http_cache.save()
+        if self._store.exists():
+            # история записывается только для изменившейся таблицы
+            with self.tracer.span('history'):
+                self.record_history()
+            # ovpn-файлы серверов, которых больше нет в таблице, не нужны
+            if self._config_cache is not None:
+                self._config_cache.prune(self._store.digests())
+        return True
+
+    def cache_stats(self) -> Tuple[int, int]:
+        """ Количество попаданий и промахов кэша HTTP ответов """
+        if self._http_cache is None:
+            return 0, 0
+        return self._http_cache.hits, self._http_cache.misses
+
+    def _check_modified(self, store: ServerStore, url: str, digest: str, response) -> None:
+        """ Проверка изменения содержимого ресурса по его хэшу
+
+        Args:
+            store (ServerStore): хранилище vpn серверов сайта
+            url (str): адрес ресурса
+            digest (str): хэш полученного содержимого
+            response (requests.Response): ответ с полученным содержимым
+
+        Raises:
+            VPNNotModifiedError: содержимое не изменилось, а хранилище существует
+        """
+        if self._http_cache is not None and store.exists() and \
+            self._http_cache.is_same(url, digest):
+            self._http_cache.hit(url, response)
+            raise VPNNotModifiedError(url)
+
+    def _cache_max_age(self, store: ServerStore) -> Optional[float]:
+        """ Срок действия кэша для условных запросов:
+            без хранилища кэш не используется
+        """
+        return self._max_age if store.exists() else None
+
+    def cancel(self) -> None:
+        """ Прерывание текущего обновления: новые данные
+            не заменят действующую таблицу
+        """
+        self._cancel_event.set()
+
+    def _check_cancelled(self) -> None:
+        """ Проверка прерывания обновления
+
+        Raises:
+            VPNUpdateCancelledError: обновление было прервано
+        """
+        if self._cancel_event.is_set():
+            raise VPNUpdateCancelledError(self._store.path)
+
+    @contextmanager
+    def _atomic_path(self, path: str) -> Iterator[str]:
+        """ Путь до временного файла, который атомарно заменяет
+            исходный только при успешном завершении записи
+
+        Args:
+            path (str): путь до итогового файла
+
+        Raises:
+            VPNUpdateCancelledError: обновление было прервано
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                        prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+        os.close(fd)
+        try:
+            yield tmp_path
+            self._check_cancelled()
+            # данные должны быть на диске до замены действующего файла
+            fd = os.open(tmp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @contextmanager
+    def _write_store(self, store: ServerStore) -> Iterator[StoreWriter]:
+        """ Запись нового хранилища vpn серверов, которое заменяет
+            действующее только при успешном обновлении
+
+        Args:
+            store (ServerStore): хранилище vpn серверов сайта
+
+        Raises:
+            VPNDownloadError: не записано ни одного vpn сервера,
+                а действующая таблица не пуста
+        """
+        with self._atomic_path(store.path) as tmp_path:
+            with store.writer(tmp_path) as writer:
+                yield writer
+                # пустой результат не заменяет непустую таблицу
+                if writer.rows == 0 and store.count() > 0:
+                    raise VPNDownloadError(f'No VPN servers downloaded for "{store.path}"')
+                commit_start = time.perf_counter()
+        # фиксация записи, fsync и замена действующего хранилища
+        self.tracer.add_time('commit', time.perf_counter() - commit_start)
+        self.tracer.count('rows_written', writer.rows)
+        self.tracer.count('config_bytes', writer.config_bytes)
+        self.tracer.count('config_bytes_stored', writer.stored_bytes)
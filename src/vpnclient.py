@@ -0,0 +1,113 @@
+""" Клиент службы vpnmgr (vpnmgr.py serve) через Unix сокет
+
+    Протокол: запрос и ответ - JSON объекты, по одному на строку.
+    Запрос содержит операцию ("op": list, best, config, ping) и ее
+    аргументы, ответ - "ok": true и результат или "ok": false и ошибку:
+    {"type": "not_found" | "query" | "index" | "bad_request", "message", "path"}
+"""
+import os
+import json
+import socket
+from typing import Any, Dict, Optional
+from vpnabc import VPNError, VPNFileNotFoundError, VPNQueryError
+
+# Имя сокета службы в рабочей директории
+SOCKET_NAME = 'vpnmgr.sock'
+# Таймаут ответа службы (сек.)
+DEFAULT_TIMEOUT = 30
+
+class VPNServiceError(VPNError):
+    """ Служба не смогла выполнить запрос """
+    def __init__(self, message: str) -> None:
+        self._message = message
+        super().__init__(message)
+
+def error_payload(ex: Exception) -> Dict[str, Any]:
+    """ Ошибка запроса для передачи клиенту """
+    if isinstance(ex, VPNFileNotFoundError):
+        return {'type': 'not_found', 'message': ex._message, 'path': ex._file_path}
+    if isinstance(ex, VPNQueryError):
+        return {'type': 'query', 'message': ex._message}
+    if isinstance(ex, IndexError):
+        return {'type': 'index', 'message': str(ex)}
+    return {'type': 'bad_request', 'message': str(ex)}
+
+def raise_error(error: Dict[str, Any]) -> None:
+    """ Исключение, соответствующее ошибке службы
+
+    Raises:
+        VPNFileNotFoundError: таблица не загружена
+        VPNQueryError: неверный запрос к таблице
+        IndexError: неверный индекс vpn сервера
+        VPNServiceError: другие ошибки
+    """
+    if error['type'] == 'not_found':
+        raise VPNFileNotFoundError(error['path'], error['message'])
+    if error['type'] == 'query':
+        raise VPNQueryError(error['message'])
+    if error['type'] == 'index':
+        raise IndexError(error['message'])
+    raise VPNServiceError(error['message'])
+
+class ServiceClient:
+    """ Соединение со службой vpnmgr """
+    def __init__(self, sock: socket.socket) -> None:
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+
+    @classmethod
+    def connect(cls, path: str, timeout: float = DEFAULT_TIMEOUT) -> Optional['ServiceClient']:
+        """ Подключение к службе
+
+        Args:
+            path (str): путь до сокета службы
+            timeout (float): таймаут ответа службы (сек.)
+
+        Returns:
+            Optional[ServiceClient]: соединение, None - служба не запущена
+        """
+        if not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError:
+            # сокет остался от завершенной службы
+            sock.close()
+            return None
+        return cls(sock)
+
+    def request(self, op: str, **args: Any) -> Dict[str, Any]:
+        """ Выполнение операции службой
+
+        Raises:
+            VPNServiceError: служба закрыла соединение или не ответила
+            VPNFileNotFoundError, VPNQueryError, IndexError: ошибка запроса
+
+        Returns:
+            Dict[str, Any]: результат операции
+        """
+        try:
+            self._file.write(json.dumps({'op': op, **args}).encode('utf8') + b'\n')
+            self._file.flush()
+            line = self._file.readline()
+        except OSError as ex:
+            raise VPNServiceError(f'VPN service request failed: {ex}') from ex
+        if not line:
+            raise VPNServiceError('VPN service closed the connection')
+
+        response = json.loads(line)
+        if not response.get('ok'):
+            raise_error(response['error'])
+        return response
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> 'ServiceClient':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
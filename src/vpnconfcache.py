@@ -0,0 +1,168 @@
+""" Кэш ovpn-файлов в рабочей директории
+
+    Файл конфигурации называется по хэшу содержимого (<site>-<digest>.ovpn),
+    поэтому повторное подключение к тому же серверу не распаковывает и не
+    перезаписывает файл, а после обновления таблицы индекс сервера не может
+    указать на файл другого сервера. Размер кэша ограничен количеством
+    файлов, их суммарным размером и возрастом, первыми удаляются давно
+    не использованные файлы (время изменения обновляется при каждом обращении).
+    Вытеснение освобождает четверть кэша, поэтому директория просматривается
+    не при каждой записи файла
+"""
+import os
+import re
+import time
+import tempfile
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+# Ограничения кэша одного сайта по умолчанию
+MAX_FILES = 64
+MAX_BYTES = 16 * 1024 * 1024
+# Максимальный возраст неиспользуемого файла (сек.)
+MAX_AGE = 30 * 24 * 3600
+# Доля ограничений, до которой вытеснение сокращает кэш
+_LOW_WATERMARK = 0.75
+
+class _CachedFile(NamedTuple):
+    path: str
+    digest: Optional[str]
+    size: int
+    mtime: float
+
+class ConfigCache:
+    """ Кэш ovpn-файлов одного сайта по хэшу содержимого """
+    def __init__(self, folder: str, prefix: str, max_files: int = MAX_FILES,
+                 max_bytes: int = MAX_BYTES, max_age: float = MAX_AGE) -> None:
+        """
+        Args:
+            folder (str): рабочая директория
+            prefix (str): префикс имен файлов сайта (vpngate, freevpn, ...)
+            max_files (int): максимальное количество файлов
+            max_bytes (int): максимальный суммарный размер файлов (байт)
+            max_age (float): максимальный возраст неиспользуемого файла (сек.)
+        """
+        self._folder = folder
+        self._prefix = prefix
+        self._max_files = max_files
+        self._max_bytes = max_bytes
+        self._max_age = max_age
+        # файлы кэша и файлы прежнего формата (<site>-<index>.ovpn)
+        self._name_re = re.compile(rf'^{re.escape(prefix)}-(?:([0-9a-f]{{32}})|\d{{1,9}})\.ovpn$')
+        # количество и размер файлов кэша по последнему просмотру директории
+        # и записанным с тех пор файлам, None - директория не просматривалась
+        self._usage: Optional[Tuple[int, int]] = None
+        # количество попаданий и промахов кэша за время работы
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, digest: str) -> str:
+        """ Путь до ovpn-файла с заданным хэшем содержимого """
+        return os.path.join(self._folder, f'{self._prefix}-{digest}.ovpn')
+
+    def get(self, digest: str) -> Optional[str]:
+        """ Путь до сохраненного ovpn-файла
+
+        Returns:
+            Optional[str]: путь до файла, None - файла нет в кэше
+        """
+        path = self.path(digest)
+        try:
+            # время изменения - время последнего использования
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, digest: str, data: bytes) -> str:
+        """ Сохранение ovpn-файла и вытеснение старых файлов
+
+        Returns:
+            str: путь до сохраненного файла
+        """
+        path = self.path(digest)
+        # файл виден другим процессам только целиком; mkstemp создает его
+        # с правами 0600, конфигурации содержат ключи
+        fd, tmp_path = tempfile.mkstemp(dir=self._folder, prefix=f'.{self._prefix}-',
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self._usage is not None:
+            self._usage = (self._usage[0] + 1, self._usage[1] + len(data))
+        if self._usage is None or self._usage[0] > self._max_files or \
+            self._usage[1] > self._max_bytes:
+            self.evict(keep=path)
+        return path
+
+    def _files(self) -> List[_CachedFile]:
+        files = []
+        with os.scandir(self._folder) as entries:
+            for entry in entries:
+                match = self._name_re.match(entry.name)
+                if match is None:
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append(_CachedFile(entry.path, match.group(1), stat.st_size, stat.st_mtime))
+        return files
+
+    def _remove(self, files: Iterable[_CachedFile]) -> int:
+        removed = 0
+        for file in files:
+            try:
+                os.remove(file.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """ Удаление устаревших файлов и давно не использованных файлов
+            сверх ограничений кэша
+
+        Args:
+            keep (Optional[str]): путь до файла, который не удаляется
+
+        Returns:
+            int: количество удаленных файлов
+        """
+        expired = time.time() - self._max_age
+        files = sorted(self._files(), key=lambda file: file.mtime, reverse=True)
+        over = len(files) > self._max_files or sum(file.size for file in files) > self._max_bytes
+        # при превышении ограничений кэш сокращается с запасом
+        max_files = int(self._max_files * _LOW_WATERMARK) if over else self._max_files
+        max_bytes = int(self._max_bytes * _LOW_WATERMARK) if over else self._max_bytes
+
+        stale, count, size = [], 0, 0
+        # от недавно использованных к давно использованным
+        for file in files:
+            if file.path != keep and (file.digest is None or file.mtime < expired or
+                                      count >= max_files or size + file.size > max_bytes):
+                stale.append(file)
+                continue
+            count += 1
+            size += file.size
+        self._usage = (count, size)
+        return self._remove(stale)
+
+    def prune(self, digests: Iterable[str]) -> int:
+        """ Удаление файлов серверов, которых нет в обновленной таблице
+
+        Args:
+            digests (Iterable[str]): хэши конфигураций таблицы
+
+        Returns:
+            int: количество удаленных файлов
+        """
+        current = set(digests)
+        self._usage = None
+        return self._remove(file for file in self._files() if file.digest not in current)
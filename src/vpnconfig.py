@@ -0,0 +1,80 @@
+""" Разбор ovpn-файлов конфигурации """
+import re
+from typing import NamedTuple, Optional, Tuple
+
+# Порт и протокол OpenVPN по умолчанию
+DEFAULT_PORT = 1194
+DEFAULT_PROTO = 'udp'
+
+# Директивы, которые сохраняются в столбцы таблицы, и до трех их аргументов;
+# строки встроенных блоков (base64) не содержат пробелов и не совпадают
+_DIRECTIVE_RE = re.compile(rb'^[ \t]*(remote|port|proto|cipher|data-ciphers|ncp-ciphers|auth)'
+                           rb'[ \t]+([^\s#;]+)(?:[ \t]+([^\s#;]+))?(?:[ \t]+([^\s#;]+))?',
+                           re.MULTILINE)
+
+class ConfigFields(NamedTuple):
+    """ Директивы ovpn-файла """
+    # хост и порт первой директивы remote, None - директивы нет
+    remote_host: Optional[str]
+    remote_port: int
+    # протокол: udp/tcp
+    proto: str
+    # шифр (cipher или первый из data-ciphers) и HMAC (auth), None - по умолчанию
+    cipher: Optional[str]
+    auth: Optional[str]
+
+def normalize_proto(proto: str) -> str:
+    """ Приведение протокола OpenVPN (udp4, tcp-client, ...) к udp/tcp """
+    return 'tcp' if proto.lower().startswith('tcp') else 'udp'
+
+def parse_directives(config: bytes) -> ConfigFields:
+    """ Директивы ovpn-файла за один проход регулярным выражением
+
+    Args:
+        config (bytes): содержимое ovpn-файла или только его директивы
+
+    Returns:
+        ConfigFields: адрес vpn сервера, протокол, шифр и HMAC
+    """
+    host, port, proto = None, DEFAULT_PORT, DEFAULT_PROTO
+    remote_port, remote_proto = None, None
+    cipher, data_cipher, auth = None, None, None
+
+    for name, arg1, arg2, arg3 in _DIRECTIVE_RE.findall(config):
+        if name == b'remote':
+            if host is None:
+                host = arg1.decode('utf8', errors='replace')
+                if arg2.isdigit():
+                    remote_port = int(arg2)
+                if arg3:
+                    remote_proto = arg3.decode('ascii', errors='replace')
+        elif name == b'port':
+            if arg1.isdigit():
+                port = int(arg1)
+        elif name == b'proto':
+            proto = arg1.decode('ascii', errors='replace')
+        elif name == b'cipher':
+            cipher = arg1.decode('ascii', errors='replace').upper()
+        elif name == b'auth':
+            auth = arg1.decode('ascii', errors='replace').upper()
+        elif data_cipher is None:
+            # data-ciphers (OpenVPN 2.5+) и ncp-ciphers: список через ":"
+            data_cipher = arg1.decode('ascii', errors='replace').split(':')[0].upper()
+
+    return ConfigFields(host, remote_port or port, normalize_proto(remote_proto or proto),
+                        cipher or data_cipher, auth)
+
+def parse_endpoint(config: bytes) -> Optional[Tuple[str, int, str]]:
+    """ Адрес vpn сервера из ovpn-файла (первая директива remote)
+
+    Args:
+        config (bytes): содержимое ovpn-файла
+
+    Returns:
+        Optional[Tuple[str, int, str]]: хост, порт и протокол (udp/tcp),
+            None - если директива remote отсутствует
+    """
+    fields = parse_directives(config)
+    if fields.remote_host is None:
+        return None
+    return fields.remote_host, fields.remote_port, fields.proto
@@ -0,0 +1,140 @@
+""" Выгрузка ovpn-файлов таблиц: export
+
+    Конфигурации каждой таблицы читаются из хранилища за один проход
+    (ServerStore.configs) и записываются в директорию или в один архив
+    tar (.tar, .tar.gz, .tgz, .tar.xz) или zip. Файлы называются
+    <таблица>-<индекс>.ovpn и создаются с правами 0600: конфигурации
+    содержат ключи. Общие части конфигураций сайта распаковываются один раз
+    (кэш StoreReader), поэтому выгрузка таблицы занимает примерно столько же,
+    сколько ее последовательное чтение и запись файлов
+"""
+import io
+import os
+import time
+import tarfile
+import zipfile
+import tempfile
+from typing import Iterable, Optional, Tuple
+
+def archive_format(path: str) -> Optional[str]:
+    """ Формат архива по расширению файла
+
+    Returns:
+        Optional[str]: режим записи tarfile ('w', 'w:gz', 'w:xz'), 'zip'
+            или None - путь до директории
+    """
+    name = path.lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'w:gz'
+    if name.endswith('.tar.xz'):
+        return 'w:xz'
+    if name.endswith('.tar'):
+        return 'w'
+    return None
+
+class _DirectoryWriter:
+    """ Запись ovpn-файлов в директорию """
+    def __init__(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+
+    def add(self, name: str, data: bytes) -> None:
+        fd = os.open(os.path.join(self._path, name), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+
+    def close(self, ok: bool) -> None:
+        pass
+
+class _ArchiveWriter:
+    """ Запись ovpn-файлов в архив, который заменяет файл назначения
+        только при успешном завершении
+    """
+    def __init__(self, path: str, mode: str) -> None:
+        self._path = path
+        fd, self._tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                              prefix=f'.{os.path.basename(path)}.',
+                                              suffix='.tmp')
+        self._file = os.fdopen(fd, 'wb')
+        self._mtime = time.time()
+        if mode == 'zip':
+            self._tar = None
+            self._zip = zipfile.ZipFile(self._file, 'w', zipfile.ZIP_DEFLATED)
+        else:
+            self._zip = None
+            # уровень утилиты gzip: уровень 9 (по умолчанию в tarfile) в полтора раза
+            # медленнее, а архив меньше лишь на пятую часть
+            kwargs = {'compresslevel': 6} if mode == 'w:gz' else {}
+            self._tar = tarfile.open(fileobj=self._file, mode=mode, **kwargs)
+
+    def add(self, name: str, data: bytes) -> None:
+        if self._zip is not None:
+            info = zipfile.ZipInfo(name, time.localtime(self._mtime)[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = 0o600 << 16
+            self._zip.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o600
+            info.mtime = self._mtime
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def close(self, ok: bool) -> None:
+        try:
+            (self._zip or self._tar).close()
+            self._file.close()
+            if ok:
+                os.replace(self._tmp_path, self._path)
+        finally:
+            if os.path.exists(self._tmp_path):
+                os.remove(self._tmp_path)
+
+class ConfigExporter:
+    """ Выгрузка ovpn-файлов в директорию или архив """
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): директория или архив (по расширению: .zip, .tar, .tar.gz,
+                .tgz, .tar.xz)
+        """
+        mode = archive_format(path)
+        self._writer = _DirectoryWriter(path) if mode is None else _ArchiveWriter(path, mode)
+        # количество и суммарный размер выгруженных файлов
+        self.files = 0
+        self.bytes = 0
+
+    def add(self, table: str, configs: Iterable[Tuple[int, bytes]]) -> int:
+        """ Выгрузка конфигураций одной таблицы
+
+        Args:
+            table (str): имя таблицы
+            configs (Iterable[Tuple[int, bytes]]): индекс vpn сервера и
+                содержимое ovpn-файла
+
+        Returns:
+            int: количество выгруженных файлов таблицы
+        """
+        files = 0
+        for index, data in configs:
+            self._writer.add(f'{table}-{index}.ovpn', data)
+            files += 1
+            self.bytes += len(data)
+        self.files += files
+        return files
+
+    def close(self, ok: bool = True) -> None:
+        """ Завершение записи
+
+        Args:
+            ok (bool): False - выгрузка прервана, архив не создается
+        """
+        self._writer.close(ok)
+
+    def __enter__(self) -> 'ConfigExporter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(exc_type is None)
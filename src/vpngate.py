@@ -2,102 +2,127 @@
 """ VPNGate """
 import os
 import csv
-import requests
+import binascii
+import tempfile
+import hashlib
+from typing import TYPE_CHECKING, Any, Iterator, Optional
 from base64 import b64decode
-from prettytable import PrettyTable
 from vpnabc import (
-    AbcSite, VPNFileNotFoundError
+    AbcSite, ListColumn, ServerMetrics, VPNFileNotFoundError
 )
+from vpnstore import ServerStore
+from vpnconfcache import ConfigCache
+from vpnhttp import Fetcher, HTTPCache, DEFAULT_WORKERS
+
+if TYPE_CHECKING:
+    import requests
+
+def _to_float(value: str, scale: float = 1) -> Optional[float]:
+    """ Число из столбца ответа API, None - значение отсутствует """
+    try:
+        return float(value) * scale
+    except (TypeError, ValueError):
+        return None
 
 class VPNGate(AbcSite):
     """ Класс - парсер VPN серверов с сайта www.vpngate.net """
     __url = 'http://www.vpngate.net/api/iphone/'
-    __csv_name = 'vpngate.csv'
-    __table_ip = 'IP'
-    __table_speed = 'Speed (Mb/s)'
-    __table_ping = 'Ping (ms)'
-    __table_country = 'Country'
+    __db_name = 'vpngate.db'
+    __cache_name = 'vpngate.cache.json'
+    _list_columns = AbcSite._list_columns + [
+        ListColumn('country', 'Country', 'country'),
+        ListColumn('ip', 'IP', 'ip'),
+        ListColumn('speed', 'Speed (Mb/s)', "printf('%.2f', speed / 1048576.0)"),
+        ListColumn('ping', 'Ping (ms)', 'ping'),
+    ]
     __csv_delimeter = ','
-
-    def __init__(self, workfolder: str) -> None:
-        super().__init__(workfolder)
-        self.__csv_path = os.path.join(self._workfolder, self.__csv_name)
-
-    def table(self) -> str:
-        """ Получение таблицы vpn серверов
-
-        Raises:
-            VPNFileNotFoundError: Отсутствует файл со списком vpn серверов
-
-        Returns:
-            str: таблица vpn-серверов
-        """
-        # Существует ли файл со всеми конфигурациями
-        # vpn серверов
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-        # заголовки к результирующей таблице
-        header = ['№', self.__table_country, self.__table_ip, self.__table_speed, self.__table_ping]
-        table = PrettyTable(header)
-        # заполнение таблицы данными vpn серверов
-        with open(self.__csv_path, 'r') as file:
-            for i, items in enumerate(csv.reader(file, delimiter=self.__csv_delimeter)):
-                if i == 0:
-                    continue
-                country = items[5]
-                ip = items[1]
-                speed = '{0:.2f}'.format(int(items[4]) / (1024 * 1024))
-                ping = items[3]
-                table.add_row([i, country, ip, speed, ping])
-        return str(table)
-
-    def _download(self) -> str:
-        """ Скачивание файла с конфинурациями vpn серверов
+    # размер блока чтения ответа API (байт)
+    __chunk_size = 64 * 1024
+    # размер ответа, до которого он хранится только в памяти (байт)
+    __spool_size = 1024 * 1024
+    # столбцы ответа API без последнего столбца с конфигурацией
+    __columns = ['host_name', 'ip', 'score', 'ping', 'speed', 'country', 'country_short',
+                 'sessions', 'uptime', 'total_users', 'total_traffic', 'log_type',
+                 'operator', 'message']
+
+    def __init__(self, workfolder: str, workers: int = DEFAULT_WORKERS) -> None:
+        super().__init__(workfolder, ServerStore(os.path.join(workfolder, self.__db_name),
+                                                 self.__columns))
+        self._http_cache = HTTPCache(os.path.join(self._workfolder, self.__cache_name))
+        self._config_cache = ConfigCache(self._workfolder, 'vpngate')
+        self.__fetcher = Fetcher(workers=workers, cache=self._http_cache,
+                                 cancel_event=self._cancel_event, tracer=self.tracer)
+
+    def metrics(self) -> Iterator[ServerMetrics]:
+        """ Показатели vpn серверов таблицы для ранжирования """
+        if not self._store.exists():
+            raise VPNFileNotFoundError(self._store.path)
+
+        for i, _, _, _, ping, speed, country, _, _, uptime, *_ in self._store.rows():
+            yield ServerMetrics(i, country, _to_float(speed, 1 / (1024 * 1024)),
+                                _to_float(ping), _to_float(uptime, 1 / 1000))
+
+    def _download(self, response: 'requests.Response', digest: Any) -> Iterator[bytes]:
+        """ Потоковое чтение файла с конфинурациями vpn серверов
             с сайта vpngate
 
-        Returns:
-            str: содержимое файла с конфигурациями
-        """
-        data = requests.get(self.__url)
-        return data.content.decode('utf8')
-
-    def update(self) -> None:
-        """ Обновление данных о vpn серверах """
-        data = self._download()
-        csv_data = '\n'.join(str(data).split('\n')[1:-2])
-        with open(self.__csv_path, 'w', encoding='utf8') as file:
-            file.write(csv_data)
-
-    def _decode_config(self, index: int) -> str:
-        """ Декодирование конфигурации заданного vpn сервера
-
         Args:
-            index (int): индекс vpn сервера из таблицы
-
-        Raises:
-            VPNFileNotFoundError: не найден файл с конфигурациями vpn серверов
-            IndexError: неверный индекс vpn сервера
+            response (requests.Response): потоковый ответ API
+            digest (Any): хэш (hashlib.sha256), дополняемый прочитанными строками
 
         Returns:
-            str: полный путь до ovpn-файла с конигурацией vpn сервера
+            Iterator[bytes]: строки с данными vpn серверов без служебных
+                строк "*vpn_servers", "#HostName,..." и "*"
         """
-        if not os.path.isfile(self.__csv_path):
-            raise VPNFileNotFoundError(self.__csv_path)
-
-        vpn_cfg_path = os.path.join(self._workfolder, f'vpngate-{str(index)}.ovpn')
-        with open(self.__csv_path, 'r') as file:
-            lines = file.readlines()
-
-            if not 0 < index < len(lines):
-                raise IndexError()
+        for line in self.__fetcher.iter_lines(response, chunk_size=self.__chunk_size):
+            self._check_cancelled()
+            if not line or line[:1] in (b'*', b'#'):
+                continue
+            digest.update(line)
+            yield line
 
-            base64_data = lines[index].split(self.__csv_delimeter)[-1]
-            decode_data = b64decode(base64_data).decode('utf8')
-
-        with open(vpn_cfg_path, 'w') as file:
-            file.write(decode_data)
+    def update(self) -> None:
+        """ Обновление данных о vpn серверах
 
-        return vpn_cfg_path
+            Ответ потоково сохраняется во временный буфер (в памяти только
+            до __spool_size байт) с подсчетом хэша. Если содержимое не
+            изменилось, строки не декодируются и хранилище не перезаписывается
+        """
+        digest = hashlib.sha256()
+
+        with tempfile.SpooledTemporaryFile(max_size=self.__spool_size) as buffer:
+            with self.tracer.span('fetch'):
+                response = self.__fetcher.get_if_modified(
+                    self.__url, self._cache_max_age(self._store), stream=True)
+                for line in self._download(response, digest):
+                    buffer.write(line + b'\n')
+            self._check_modified(self._store, self.__url, digest.hexdigest(), response)
+            buffer.seek(0)
+
+            # parse - разбор CSV целиком, включая этапы decode и write
+            with self._write_store(self._store) as writer, self.tracer.span('parse'):
+                for items in csv.reader((line.decode('utf8') for line in buffer),
+                                        delimiter=self.__csv_delimeter):
+                    self._check_cancelled()
+                    # строка с неверным количеством столбцов пропускается
+                    if len(items) != len(self.__columns) + 1:
+                        self.skipped.append(f'malformed row: {items[:2]}')
+                        continue
+                    *row, base64_data = items
+                    try:
+                        with self.tracer.span('decode'):
+                            config = b64decode(base64_data)
+                    except binascii.Error:
+                        self.skipped.append(f'malformed config: {items[:2]}')
+                        continue
+                    with self.tracer.span('write'):
+                        writer.add(row, config)
+
+        self._http_cache.miss(self.__url, response, digest.hexdigest())
+
+    def count(self) -> int:
+        """ Количество vpn серверов в таблице """
+        return self._store.count()
 
     def get_config(self, index: int) -> str:
         """ Получение полного пути до ovpn-файла
@@ -105,10 +130,14 @@ class VPNGate(AbcSite):
         Args:
             index (int): индекс vpn сервера из таблицы
 
+        Raises:
+            VPNFileNotFoundError: не найден файл с конфигурациями vpn серверов
+            IndexError: неверный индекс vpn сервера
+
         Returns:
             str: полный путь до ovpn-файла с конигурацией vpn сервера
         """
-        return self._decode_config(index)
+        return self._config_path(index)
 
 if __name__ == '__main__':
     vg = VPNGate('.')
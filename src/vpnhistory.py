@@ -0,0 +1,228 @@
+""" История обновлений таблицы и стабильность vpn серверов
+
+    История хранится рядом с таблицей сайта (<site>.history.db) и только
+    дополняется: для каждого обновления записываются лишь изменения между
+    соседними списками vpn серверов - добавленные, исчезнувшие и серверы с
+    изменившимися показателями (changes). Полные списки не хранятся.
+
+    Вместе с изменениями в той же транзакции пересчитываются оценки каждого
+    сервера (scores), поэтому рейтинг и --list читают их без разбора истории:
+    - availability - доля обновлений, в которых сервер был в списке, с его
+      первого появления;
+    - stability - экспоненциальное среднее (STABILITY_ALPHA) признака "сервер
+      есть в списке и был в предыдущем": постоянно доступный сервер
+      приближается к 1, новый и мерцающий (исчезает и появляется снова)
+      остаются около 0;
+    - flaps - сколько раз сервер исчезал из списка.
+
+    vpn сервер определяется адресом (хост, порт, протокол), а не индексом,
+    который меняется при каждом обновлении
+"""
+import time
+import sqlite3
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Вес последнего обновления в оценке стабильности
+STABILITY_ALPHA = 0.2
+# Относительное изменение скорости и задержки, которое записывается в историю
+CHANGE_THRESHOLD = 0.1
+# Количество обновлений, после которого оценки исчезнувшего сервера удаляются
+FORGET_AFTER = 1000
+
+# Адрес vpn сервера: хост, порт и протокол
+Endpoint = Tuple[str, int, str]
+# Показатели vpn сервера: страна, скорость (Мбит/с), задержка (мс), время работы (сек.)
+Snapshot = Tuple[str, Optional[float], Optional[float], Optional[float]]
+
+class ServerScore(NamedTuple):
+    """ Оценки vpn сервера по истории обновлений """
+    # экспоненциальное среднее непрерывного присутствия в списке: 0..1
+    stability: float
+    # доля обновлений, в которых сервер был в списке: 0..1
+    availability: float
+    # сколько раз сервер исчезал из списка
+    flaps: int
+
+class UpdateSummary(NamedTuple):
+    """ Изменения списка vpn серверов за одно обновление """
+    added: int
+    removed: int
+    changed: int
+
+def score_expr(column: str) -> str:
+    """ SQL выражение над таблицей servers хранилища, выбирающее столбец
+        оценок vpn сервера из подключенной истории (ServerStore.select)
+
+    Args:
+        column (str): SQL выражение над столбцами таблицы scores
+
+    Returns:
+        str: подзапрос, NULL - сервера нет в истории
+    """
+    return (f'(SELECT {column} FROM history.scores AS h WHERE h.host = servers.remote_host '
+            f'AND h.port = servers.remote_port AND h.proto = servers.proto)')
+
+def _changed(old: Optional[float], new: Optional[float]) -> bool:
+    """ Изменилась ли скорость или задержка больше чем на CHANGE_THRESHOLD """
+    if new is None or new == old:
+        return False
+    if old is None:
+        return True
+    return abs(new - old) > CHANGE_THRESHOLD * max(abs(old), abs(new))
+
+def _delta(old: Snapshot, new: Snapshot) -> Tuple[Optional[Snapshot], Snapshot]:
+    """ Изменение показателей vpn сервера между обновлениями
+
+        Неизвестные (None) показатели не меняют записанные. Время работы
+        растет с каждым обновлением, поэтому в историю оно записывается только
+        при уменьшении (перезапуск сервера)
+
+    Returns:
+        Tuple[Optional[Snapshot], Snapshot]: изменившиеся показатели (остальные
+            None), None - изменений нет; показатели для сравнения со следующим
+            обновлением
+    """
+    old_country, old_speed, old_ping, old_uptime = old
+    country, speed, ping, uptime = new
+    if country == old_country or not country:
+        country = None
+    if not _changed(old_speed, speed):
+        speed = None
+    if not _changed(old_ping, ping):
+        ping = None
+    restarted = uptime if uptime is not None and old_uptime is not None and \
+        uptime < old_uptime else None
+    stored = (country or old_country, old_speed if speed is None else speed,
+              old_ping if ping is None else ping, old_uptime if uptime is None else uptime)
+    if country is None and speed is None and ping is None and restarted is None:
+        return None, stored
+    return (country, speed, ping, restarted), stored
+
+class ServerHistory:
+    """ История обновлений таблицы одного сайта (SQLite) """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @staticmethod
+    def _create(conn: sqlite3.Connection, schema: str = 'main') -> None:
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.updates (id INTEGER PRIMARY KEY, '
+                     'time REAL NOT NULL, servers INTEGER NOT NULL, added INTEGER NOT NULL, '
+                     'removed INTEGER NOT NULL, changed INTEGER NOT NULL)')
+        # kind: added - все показатели, changed - только изменившиеся, removed - без показателей
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.changes (update_id INTEGER NOT NULL, '
+                     'host TEXT NOT NULL, port INTEGER NOT NULL, proto TEXT NOT NULL, '
+                     'kind TEXT NOT NULL, country TEXT, speed REAL, ping REAL, uptime REAL)')
+        # последние записанные показатели и оценки каждого vpn сервера
+        conn.execute(f'CREATE TABLE IF NOT EXISTS {schema}.scores (host TEXT NOT NULL, '
+                     'port INTEGER NOT NULL, proto TEXT NOT NULL, country TEXT, speed REAL, '
+                     'ping REAL, uptime REAL, present INTEGER NOT NULL, '
+                     'first_update INTEGER NOT NULL, last_seen INTEGER NOT NULL, '
+                     'seen INTEGER NOT NULL, tracked INTEGER NOT NULL, flaps INTEGER NOT NULL, '
+                     'stability REAL NOT NULL, PRIMARY KEY (host, port, proto))')
+
+    def record(self, servers: Dict[Endpoint, Snapshot]) -> UpdateSummary:
+        """ Запись обновления: изменений списка и пересчет оценок
+
+        Args:
+            servers (Dict[Endpoint, Snapshot]): показатели vpn серверов
+                обновленной таблицы по адресу
+
+        Returns:
+            UpdateSummary: количество добавленных, исчезнувших и изменившихся серверов
+        """
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            # чтение последних показателей и запись изменений - одна транзакция,
+            # иначе одновременные обновления запишут одни и те же изменения
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._create(conn)
+                summary = self._record(conn, servers)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        return summary
+
+    @staticmethod
+    def _record(conn: sqlite3.Connection, servers: Dict[Endpoint, Snapshot]) -> UpdateSummary:
+        previous = {(host, port, proto): (present, (country, speed, ping, uptime))
+                    for host, port, proto, present, country, speed, ping, uptime in conn.execute(
+                        'SELECT host, port, proto, present, country, speed, ping, uptime '
+                        'FROM scores')}
+        update_id = conn.execute('INSERT INTO updates VALUES (NULL, ?, ?, 0, 0, 0)',
+                                 (time.time(), len(servers))).lastrowid
+
+        changes, rows = [], []
+        added = changed = 0
+        for endpoint, metrics in servers.items():
+            present, old = previous.get(endpoint, (0, None))
+            if not present:
+                changes.append((update_id, *endpoint, 'added', *metrics))
+                added += 1
+                stored = metrics if old is None else \
+                    tuple(value if value is not None else last for value, last in zip(metrics, old))
+            else:
+                delta, stored = _delta(old, metrics)
+                if delta is not None:
+                    changes.append((update_id, *endpoint, 'changed', *delta))
+                    changed += 1
+            rows.append((*endpoint, *stored, update_id))
+        removed = [(update_id, *endpoint, 'removed', None, None, None, None)
+                   for endpoint, (present, _) in previous.items()
+                   if present and endpoint not in servers]
+        changes.extend(removed)
+        conn.executemany('INSERT INTO changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', changes)
+
+        # в SET используются значения столбцов до обновления строки
+        conn.executemany(
+            'INSERT INTO scores VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?8, ?8, 1, 1, 0, 0.0) '
+            'ON CONFLICT (host, port, proto) DO UPDATE SET country = excluded.country, '
+            'speed = excluded.speed, ping = excluded.ping, uptime = excluded.uptime, '
+            f'stability = stability * {1 - STABILITY_ALPHA} + {STABILITY_ALPHA} * present, '
+            'present = 1, last_seen = excluded.last_seen, seen = seen + 1, tracked = tracked + 1',
+            rows)
+        conn.execute(f'UPDATE scores SET stability = stability * {1 - STABILITY_ALPHA}, '
+                     'flaps = flaps + present, present = 0, tracked = tracked + 1 '
+                     'WHERE last_seen < ?', (update_id,))
+        conn.execute('DELETE FROM scores WHERE present = 0 AND last_seen < ?',
+                     (update_id - FORGET_AFTER,))
+        conn.execute('UPDATE updates SET added = ?, removed = ?, changed = ? WHERE id = ?',
+                     (added, len(removed), changed, update_id))
+        return UpdateSummary(added, len(removed), changed)
+
+    def scores(self) -> Dict[Endpoint, ServerScore]:
+        """ Оценки vpn серверов
+
+        Returns:
+            Dict[Endpoint, ServerScore]: оценки по адресу vpn сервера,
+                пусто - обновлений еще не было
+        """
+        if not Path(self.path).is_file():
+            return {}
+
+        conn = sqlite3.connect(f'{Path(self.path).absolute().as_uri()}?mode=ro', uri=True)
+        try:
+            return {(host, port, proto): ServerScore(stability, seen / tracked, flaps)
+                    for host, port, proto, stability, seen, tracked, flaps in conn.execute(
+                        'SELECT host, port, proto, stability, seen, tracked, flaps FROM scores')}
+        finally:
+            conn.close()
+
+    def attach(self, conn: sqlite3.Connection) -> None:
+        """ Подключение истории к соединению с хранилищем как схемы history
+            только для чтения; без файла истории подключается пустая схема,
+            и оценки всех vpn серверов равны NULL
+
+        Args:
+            conn (sqlite3.Connection): соединение, открытое с uri=True
+        """
+        if Path(self.path).is_file():
+            conn.execute('ATTACH DATABASE ? AS history',
+                         (f'{Path(self.path).absolute().as_uri()}?mode=ro',))
+        else:
+            conn.execute("ATTACH DATABASE ':memory:' AS history")
+            self._create(conn, 'history')
@@ -0,0 +1,201 @@
+""" Выборочное извлечение элементов HTML страниц
+
+    Извлекаются только элементы, подходящие под селекторы, без построения
+    дерева всей страницы. Селектор - имя тега и/или класс: "a.maxbutton",
+    "li", ".list". Используется самый быстрый из установленных движков:
+    selectolax, lxml или встроенный html.parser (без зависимостей)
+"""
+from functools import lru_cache
+from importlib.util import find_spec
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+# Теги без закрывающего тега
+_VOID_TAGS = frozenset(['area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+                        'link', 'meta', 'source', 'track', 'wbr'])
+
+class Element(NamedTuple):
+    """ Извлеченный элемент страницы """
+    tag: str
+    attrs: Dict[str, str]
+    # текст элемента и всех вложенных элементов
+    text: str
+    # ссылки (href) вложенных элементов <a>
+    links: List[str]
+
+def parse_selector(selector: str) -> Tuple[Optional[str], Optional[str]]:
+    """ Разбор селектора "tag.class"
+
+    Raises:
+        ValueError: пустой селектор
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: тег и класс, None - любой
+    """
+    tag, _, cls = selector.strip().partition('.')
+    if not tag and not cls:
+        raise ValueError(f'Invalid selector: "{selector}"')
+    return tag.lower() or None, cls or None
+
+class _OpenElement:
+    """ Элемент, закрывающий тег которого еще не прочитан """
+    __slots__ = ('name', 'index', 'tag', 'attrs', 'text', 'links', 'depth')
+
+    def __init__(self, name: str, index: int, tag: str, attrs: Dict[str, str]) -> None:
+        self.name = name
+        self.index = index
+        self.tag = tag
+        self.attrs = attrs
+        self.text: List[str] = []
+        self.links: List[str] = []
+        # количество открытых вложенных элементов с тем же тегом
+        self.depth = 0
+
+class _Extractor(HTMLParser):
+    """ Потоковый разбор страницы с сохранением только нужных элементов """
+    def __init__(self, selectors: Mapping[str, str]) -> None:
+        super().__init__(convert_charrefs=True)
+        self._selectors = [(name, *parse_selector(selector))
+                           for name, selector in selectors.items()]
+        self.results: Dict[str, List[Optional[Element]]] = {name: [] for name in selectors}
+        self._open: List[_OpenElement] = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        attributes = None
+        if self._open:
+            if tag == 'a':
+                attributes = {key: value or '' for key, value in attrs}
+                if 'href' in attributes:
+                    for element in self._open:
+                        element.links.append(attributes['href'])
+            if tag not in _VOID_TAGS:
+                for element in self._open:
+                    if element.tag == tag:
+                        element.depth += 1
+
+        for name, sel_tag, sel_cls in self._selectors:
+            if sel_tag is not None and sel_tag != tag:
+                continue
+            if attributes is None:
+                attributes = {key: value or '' for key, value in attrs}
+            if sel_cls is not None and sel_cls not in attributes.get('class', '').split():
+                continue
+            # место элемента в порядке следования на странице
+            results = self.results[name]
+            results.append(None)
+            if tag in _VOID_TAGS:
+                results[-1] = Element(tag, attributes, '', [])
+            else:
+                self._open.append(_OpenElement(name, len(results) - 1, tag, attributes))
+
+    def handle_endtag(self, tag: str) -> None:
+        if not self._open:
+            return
+        still_open = []
+        for element in self._open:
+            if element.tag != tag:
+                still_open.append(element)
+            elif element.depth:
+                element.depth -= 1
+                still_open.append(element)
+            else:
+                self.results[element.name][element.index] = Element(
+                    element.tag, element.attrs, ''.join(element.text).strip(), element.links)
+        self._open = still_open
+
+    def handle_data(self, data: str) -> None:
+        for element in self._open:
+            element.text.append(data)
+
+    def close(self) -> None:
+        super().close()
+        # незакрытые до конца страницы элементы
+        for element in self._open:
+            self.results[element.name][element.index] = Element(
+                element.tag, element.attrs, ''.join(element.text).strip(), element.links)
+        self._open = []
+
+def _extract_html_parser(html: str, selectors: Mapping[str, str]) -> Dict[str, List[Element]]:
+    extractor = _Extractor(selectors)
+    extractor.feed(html)
+    extractor.close()
+    return extractor.results
+
+def _extract_lxml(html: str, selectors: Mapping[str, str]) -> Dict[str, List[Element]]:
+    from lxml import html as lxml_html
+
+    root = lxml_html.fromstring(html)
+    results = {}
+    for name, selector in selectors.items():
+        tag, cls = parse_selector(selector)
+        xpath = f'//{tag or "*"}'
+        if cls is not None:
+            xpath += f'[contains(concat(" ", normalize-space(@class), " "), " {cls} ")]'
+        results[name] = [
+            Element(node.tag, {key: value for key, value in node.attrib.items()},
+                    node.text_content().strip(),
+                    [link.get('href') for link in node.iterdescendants('a')
+                     if link.get('href') is not None])
+            for node in root.xpath(xpath)]
+    return results
+
+def _extract_selectolax(html: str, selectors: Mapping[str, str]) -> Dict[str, List[Element]]:
+    from selectolax.parser import HTMLParser as LexborParser
+
+    tree = LexborParser(html)
+    results = {}
+    for name, selector in selectors.items():
+        parse_selector(selector)
+        results[name] = [
+            Element(node.tag, {key: value or '' for key, value in node.attributes.items()},
+                    node.text(deep=True).strip(),
+                    [link.attributes['href'] for link in node.css('a')
+                     if link.mem_id != node.mem_id and link.attributes.get('href') is not None])
+            for node in tree.css(selector)]
+    return results
+
+# Движки в порядке предпочтения: имя, модуль и функция извлечения
+ENGINES: Dict[str, Tuple[Optional[str], Callable[[str, Mapping[str, str]],
+                                                 Dict[str, List[Element]]]]] = {
+    'selectolax': ('selectolax', _extract_selectolax),
+    'lxml': ('lxml', _extract_lxml),
+    'html.parser': (None, _extract_html_parser),
+}
+
+@lru_cache(maxsize=None)
+def available_engines() -> Tuple[str, ...]:
+    """ Движки, зависимости которых установлены """
+    return tuple(name for name, (module, _) in ENGINES.items()
+                 if module is None or find_spec(module) is not None)
+
+def extract(html: str, selectors: Mapping[str, str],
+            engine: Optional[str] = None) -> Dict[str, List[Element]]:
+    """ Извлечение элементов страницы по селекторам
+
+    Args:
+        html (str): текст страницы
+        selectors (Mapping[str, str]): селекторы по имени результата
+        engine (Optional[str]): движок разбора, по умолчанию - самый быстрый
+            из установленных
+
+    Raises:
+        ValueError: неверный селектор или неизвестный движок
+
+    Returns:
+        Dict[str, List[Element]]: найденные элементы в порядке следования
+            на странице по имени результата
+    """
+    if engine is None:
+        engine = available_engines()[0]
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown HTML engine: "{engine}"')
+    return ENGINES[engine][1](html, selectors)
+
+def labelled(elements: List[Element], label: str) -> Optional[str]:
+    """ Значение из первого элемента вида "<label> <value>",
+        например "Username: freevpn.me" -> "freevpn.me"
+    """
+    for element in elements:
+        if element.text.startswith(label):
+            return element.text[len(label):].strip()
+    return None
@@ -0,0 +1,271 @@
+""" HTTP-клиент для парсеров vpn серверов """
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, TYPE_CHECKING, Dict, Iterable, List, Optional, Union
+from vpnabc import VPNNotModifiedError, VPNUpdateCancelledError
+from vpntrace import Tracer
+
+if TYPE_CHECKING:
+    import requests
+
+# Таймаут одного запроса (сек.)
+DEFAULT_TIMEOUT = 15
+# Количество повторных попыток запроса
+DEFAULT_RETRIES = 3
+# Множитель экспоненциальной задержки между попытками (сек.)
+DEFAULT_BACKOFF = 0.5
+# Максимальное количество одновременных запросов
+DEFAULT_WORKERS = 16
+# Размер блока потокового чтения ответа (байт)
+CHUNK_SIZE = 64 * 1024
+
+class HTTPCache:
+    """ Кэш валидаторов HTTP ответов: ETag, Last-Modified,
+        хэш содержимого и время последней проверки ресурса
+    """
+    def __init__(self, path: str) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, object]] = {}
+        # количество попаданий и промахов кэша за время работы
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r', encoding='utf8') as file:
+                    self._entries = json.load(file)
+            except (OSError, ValueError):
+                self._entries = {}
+
+    def headers(self, url: str) -> Dict[str, str]:
+        """ Заголовки условного запроса для ресурса """
+        entry = self._entries.get(url, {})
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_fresh(self, url: str, max_age: float) -> bool:
+        """ Проверялся ли ресурс не позднее max_age секунд назад """
+        entry = self._entries.get(url)
+        return max_age > 0 and entry is not None and \
+            time.time() - entry.get('checked', 0) < max_age
+
+    def is_same(self, url: str, digest: str) -> bool:
+        """ Совпадает ли хэш содержимого ресурса с сохраненным """
+        entry = self._entries.get(url)
+        return entry is not None and entry.get('digest') == digest
+
+    def hit(self, url: str, response: Optional['requests.Response'] = None) -> None:
+        """ Учет попадания: ресурс не изменился
+
+        Args:
+            url (str): адрес ресурса
+            response (Optional[requests.Response]): ответ с тем же содержимым,
+                валидаторы которого заменяют сохраненные
+        """
+        with self._lock:
+            self.hits += 1
+            if url in self._entries:
+                self._entries[url]['checked'] = time.time()
+                if response is not None:
+                    self._entries[url]['etag'] = response.headers.get('ETag')
+                    self._entries[url]['last_modified'] = response.headers.get('Last-Modified')
+
+    def miss(self, url: str, response: 'requests.Response', digest: str) -> None:
+        """ Учет промаха: сохранение валидаторов нового содержимого """
+        with self._lock:
+            self.misses += 1
+            self._entries[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'digest': digest,
+                'checked': time.time(),
+            }
+
+    def save(self) -> None:
+        """ Сохранение кэша на диск """
+        with self._lock:
+            tmp_path = f'{self._path}.tmp'
+            with open(tmp_path, 'w', encoding='utf8') as file:
+                json.dump(self._entries, file)
+            os.replace(tmp_path, self._path)
+
+class Fetcher:
+    """ Загрузчик с общим пулом keep-alive соединений,
+        таймаутами, повторами и ограниченным параллелизмом
+
+        Сессия (и модуль requests) создается при первом запросе, поэтому
+        команды, не обращающиеся к сайтам, не платят за импорт requests
+    """
+    def __init__(self, workers: int = DEFAULT_WORKERS, timeout: float = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES, backoff: float = DEFAULT_BACKOFF,
+                 cache: Optional[HTTPCache] = None,
+                 cancel_event: Optional[threading.Event] = None,
+                 tracer: Optional[Tracer] = None) -> None:
+        self.cache = cache
+        # счетчики запросов и полученных байт
+        self._tracer = tracer or Tracer()
+        # событие прерывания: новые запросы и чтение ответов прекращаются
+        self._cancel_event = cancel_event
+        self._workers = max(1, workers)
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff = backoff
+        self._session: Optional['requests.Session'] = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self) -> 'requests.Session':
+        """ Сессия с пулом соединений, создается при первом обращении """
+        with self._session_lock:
+            if self._session is None:
+                self._session = self.__create_session(self._workers, self._retries, self._backoff)
+            return self._session
+
+    @staticmethod
+    def __create_session(pool_size: int, retries: int, backoff: float) -> 'requests.Session':
+        """ Создание сессии с пулом соединений и политикой повторов """
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        retry = Retry(total=retries, backoff_factor=backoff,
+                      status_forcelist=(429, 500, 502, 503, 504),
+                      allowed_methods=frozenset(['GET', 'HEAD']))
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url: str, **kwargs) -> 'requests.Response':
+        """ GET запрос
+
+        Args:
+            url (str): адрес ресурса
+
+        Raises:
+            VPNUpdateCancelledError: загрузка прервана
+            requests.RequestException: ошибка запроса после всех повторов
+
+        Returns:
+            requests.Response: ответ сервера
+        """
+        self.check_cancelled(url)
+        kwargs.setdefault('timeout', self._timeout)
+        response = self.session.get(url, **kwargs)
+        self._tracer.count('requests')
+        response.raise_for_status()
+        if not kwargs.get('stream'):
+            self._tracer.count('bytes_fetched', len(response.content))
+        return response
+
+    def check_cancelled(self, url: str) -> None:
+        """ Проверка прерывания загрузки
+
+        Raises:
+            VPNUpdateCancelledError: загрузка прервана
+        """
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise VPNUpdateCancelledError(url)
+
+    def iter_content(self, response: 'requests.Response',
+                     chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+        """ Потоковое чтение ответа блоками с проверкой прерывания
+
+        Raises:
+            VPNUpdateCancelledError: загрузка прервана
+        """
+        with response:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                self.check_cancelled(response.url)
+                yield chunk
+            self._tracer.count('bytes_fetched', response.raw.tell())
+
+    def iter_lines(self, response: 'requests.Response',
+                   chunk_size: int = CHUNK_SIZE) -> Iterable[bytes]:
+        """ Потоковое чтение ответа построчно с проверкой прерывания
+
+        Raises:
+            VPNUpdateCancelledError: загрузка прервана
+        """
+        with response:
+            for line in response.iter_lines(chunk_size=chunk_size):
+                self.check_cancelled(response.url)
+                yield line
+            self._tracer.count('bytes_fetched', response.raw.tell())
+
+    def get_if_modified(self, url: str, max_age: Optional[float] = 0,
+                        conditional: bool = True, **kwargs) -> 'requests.Response':
+        """ Условный GET запрос с учетом кэша
+
+        Args:
+            url (str): адрес ресурса
+            max_age (Optional[float]): время (сек.), в течение которого ресурс
+                не перепроверяется; None - запрос без учета кэша
+            conditional (bool): отправлять ли валидаторы (If-None-Match,
+                If-Modified-Since); False - проверяется только срок max_age
+
+        Raises:
+            VPNNotModifiedError: ресурс не изменился или проверялся недавно
+            requests.RequestException: ошибка запроса после всех повторов
+
+        Returns:
+            requests.Response: ответ сервера с новым содержимым
+        """
+        if self.cache is None or max_age is None:
+            return self.get(url, **kwargs)
+
+        if self.cache.is_fresh(url, max_age):
+            self.cache.hit(url)
+            raise VPNNotModifiedError(url)
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if conditional:
+            headers.update(self.cache.headers(url))
+        response = self.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304:
+            response.close()
+            self.cache.hit(url)
+            raise VPNNotModifiedError(url)
+        return response
+
+    def _try_get(self, url: str) -> Union['requests.Response', Exception]:
+        """ GET запрос, возвращающий ошибку вместо исключения """
+        import requests
+
+        try:
+            return self.get(url)
+        except (requests.RequestException, VPNUpdateCancelledError) as ex:
+            return ex
+
+    def fetch_all(self, urls: Iterable[str]
+                  ) -> List[Union['requests.Response', Exception]]:
+        """ Параллельное скачивание списка ресурсов
+
+        Args:
+            urls (Iterable[str]): адреса ресурсов
+
+        Returns:
+            List[Union[requests.Response, Exception]]: ответы в порядке
+                адресов или ошибки скачивания соответствующих ресурсов
+
+        Raises:
+            VPNUpdateCancelledError: загрузка прервана
+        """
+        urls = list(urls)
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            responses = list(pool.map(self._try_get, urls))
+        # оставшиеся после прерывания запросы не выполнялись
+        if urls:
+            self.check_cancelled(urls[0])
+        return responses
@@ -0,0 +1,138 @@
+""" Вывод таблиц vpn серверов: фильтры, сортировка и форматы """
+import re
+import csv
+import json
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, TextIO, Tuple
+
+# Доступные форматы вывода
+FORMATS = ('table', 'json', 'csv')
+
+_FILTER_RE = re.compile(r'^\s*(\w+)\s*(!=|<=|>=|=|<|>|~)\s*(.*?)\s*$')
+_RANGE_RE = re.compile(r'^\s*(\d+)\s*(?:(-)\s*(\d*)\s*)?$')
+
+def parse_filter(text: str) -> Tuple[str, str, str]:
+    """ Разбор фильтра вида "ping<100", "country=Japan", "ip~10.0."
+
+    Raises:
+        ValueError: неверный формат фильтра
+
+    Returns:
+        Tuple[str, str, str]: столбец, оператор и значение
+    """
+    match = _FILTER_RE.match(text)
+    if match is None:
+        raise ValueError(f'Invalid filter: "{text}"')
+    return match.group(1).lower(), match.group(2), match.group(3)
+
+def parse_sort(text: str) -> Tuple[str, bool]:
+    """ Разбор сортировки вида "ping" (по возрастанию) или "-speed" (по убыванию)
+
+    Returns:
+        Tuple[str, bool]: столбец и признак сортировки по убыванию
+    """
+    return text.lstrip('-').lower(), text.startswith('-')
+
+def parse_ranges(text: str) -> List[Tuple[int, Optional[int]]]:
+    """ Разбор индексов vpn серверов вида "1-100,250,900-"
+
+    Raises:
+        ValueError: неверный формат индексов
+
+    Returns:
+        List[Tuple[int, Optional[int]]]: первый и последний индексы
+            диапазонов, None - до конца таблицы
+    """
+    ranges = []
+    for part in text.split(','):
+        match = _RANGE_RE.match(part)
+        if match is None:
+            raise ValueError(f'Invalid index range: "{part}"')
+        first = int(match.group(1))
+        if match.group(2) is None:
+            last: Optional[int] = first
+        else:
+            last = int(match.group(3)) if match.group(3) else None
+        if last is not None and last < first:
+            raise ValueError(f'Invalid index range: "{part}"')
+        ranges.append((first, last))
+    return ranges
+
+def in_ranges(index: int, ranges: Iterable[Tuple[int, Optional[int]]]) -> bool:
+    """ Входит ли индекс vpn сервера в один из диапазонов """
+    return any(first <= index and (last is None or index <= last) for first, last in ranges)
+
+def _cell(value: Any) -> str:
+    return '' if value is None else str(value)
+
+def table_lines(header: Sequence[str],
+                rows: Callable[[], Iterable[Sequence[Any]]]) -> Iterator[str]:
+    """ Строки текстовой таблицы
+
+        Таблица строится за два прохода по строкам (ширина столбцов,
+        затем вывод), поэтому строки целиком в памяти не хранятся
+
+    Args:
+        header (Sequence[str]): заголовки столбцов
+        rows (Callable[[], Iterable[Sequence[Any]]]): функция, возвращающая
+            новый итератор по строкам таблицы
+
+    Returns:
+        Iterator[str]: строки таблицы
+    """
+    widths = [len(name) for name in header]
+    for row in rows():
+        widths = [max(width, len(_cell(value))) for width, value in zip(widths, row)]
+
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+
+    def line(values: Sequence[Any]) -> str:
+        return '|' + '|'.join(f' {_cell(value):^{width}} '
+                              for value, width in zip(values, widths)) + '|'
+
+    yield border
+    yield line(header)
+    yield border
+    for row in rows():
+        yield line(row)
+    yield border
+
+def write_table(stream: TextIO, name: str, header: Sequence[str],
+                rows: Callable[[], Iterable[Sequence[Any]]]) -> None:
+    """ Вывод текстовой таблицы построчно """
+    lines = table_lines(header, rows)
+    # ошибки запроса возникают до вывода заголовка
+    border = next(lines)
+    print(f'Table: {name}', file=stream)
+    print(border, file=stream)
+    for line in lines:
+        print(line, file=stream)
+    print(file=stream)
+
+def write_csv(stream: TextIO, name: str, header: Sequence[str],
+              rows: Iterable[Sequence[Any]]) -> None:
+    """ Вывод таблицы в формате CSV построчно, первый столбец - имя таблицы """
+    writer = csv.writer(stream)
+    writer.writerow(['table', *header])
+    for row in rows:
+        writer.writerow([name, *row])
+
+class JSONWriter:
+    """ Вывод строк всех таблиц одним JSON массивом по мере получения """
+    def __init__(self, stream: TextIO) -> None:
+        self._stream = stream
+        self._first = True
+
+    def __enter__(self) -> 'JSONWriter':
+        self._stream.write('[')
+        return self
+
+    def write(self, name: str, keys: Sequence[str], rows: Iterable[Sequence[Any]]) -> None:
+        """ Вывод строк таблицы объектами с полем table """
+        for row in rows:
+            self._stream.write('\n' if self._first else ',\n')
+            self._first = False
+            self._stream.write(json.dumps({'table': name, **dict(zip(keys, row))},
+                                          ensure_ascii=False))
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._stream.write('\n]\n')
@@ -1,100 +1,615 @@
 import os
 import sys
-from argparse import ArgumentParser
-from typing import List
+import time
+import itertools
+import threading
+from argparse import ArgumentParser, Namespace
+from contextlib import ExitStack
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence
 from pathlib import Path
-from typing import Dict
-from vpnabc import AbcSite, VPNFileNotFoundError
-from vpngate import VPNGate
-from freevpn import FreeVPN
-from ipspeed import IPSpeedVPN
+from typing import Dict, Set, Tuple
+from statistics import median
+from vpnabc import AbcSite, VPNError, VPNFileNotFoundError, VPNQueryError
+from vpnrank import RankedServer, RankIndex
+from vpnregistry import SiteRegistry
+from vpntrace import FORMATS as METRICS_FORMATS, Tracer, export
+from vpnlist import FORMATS, JSONWriter, parse_filter, parse_ranges, parse_sort, write_csv, \
+    write_table
 
 CONF_DIR = 'ovpn.conf.d'
 WORK_FOLDER = str(Path(sys.argv[0]).parent / CONF_DIR)
 OVPN_BIN = '/usr/sbin/openvpn'
+RANK_NAME = 'ranking.db'
+# Сокет службы (vpnmgr.py serve), совпадает с vpnclient.SOCKET_NAME
+SOCKET_NAME = 'vpnmgr.sock'
+# Срок обновления одного сайта (сек.)
+UPDATE_TIMEOUT = 300
+# Срок подключения к одному vpn серверу (сек.) и количество vpn серверов,
+# к которым пытается подключиться connect (vpnsupervisor)
+CONNECT_TIMEOUT = 30
+CONNECT_ATTEMPTS = 3
+# Интервал обновления сайтов службой (сек.), совпадает с vpnserve.DEFAULT_INTERVAL
+SERVE_INTERVAL = 3600
+
+def parse_interval(text: str) -> Tuple[str, float]:
+    """ Разбор интервала обновления сайта вида "vpngate=1800"
+
+    Raises:
+        ValueError: неверный формат интервала
+
+    Returns:
+        Tuple[str, float]: имя таблицы и интервал (сек.)
+    """
+    key, sep, value = text.partition('=')
+    if not sep or not key.strip():
+        raise ValueError(f'Invalid interval: "{text}"')
+    return key.strip(), float(value)
 
 class VPNManager:
-    """ Менеджер, управляющий всеми парсерами """
+    """ Менеджер, управляющий всеми парсерами
 
-    # Список доступных сайтовс vpn серверами
-    __vpn_parsers: Dict[str, AbcSite] = {
-        'vpngate': VPNGate(WORK_FOLDER),
-        'freevpn': FreeVPN(WORK_FOLDER),
-        'ipspeed': IPSpeedVPN(WORK_FOLDER)
-    }
+        Парсеры создаются только для сайтов, нужных выполняемой команде
+    """
 
     def __init__(self, argv: List[str]) -> None:
         self.__init_conf_dir()
         self.__parser = self.__init_parser()
         self.__argv = argv
-    
+        # Список доступных сайтов с vpn серверами
+        self.__vpn_sites = SiteRegistry()
+        self.__vpn_parsers: Dict[str, AbcSite] = {}
+        self.__workers: Optional[int] = None
+        # длительность команд, этапы сайтов собираются их трассировщиками
+        self.__tracer = Tracer()
+        self.__rank = RankIndex(os.path.join(WORK_FOLDER, RANK_NAME))
+        # соединение с запущенной службой, False - служба не используется
+        self.__service = None
+        self.__socket: Optional[str] = None
+        self.__local = False
+
     def start(self) -> None:
         """ Метод, обработывающий аргументы командной строки """
         ns = self.__parser.parse_args(self.__argv[1:])
-        
+        self.__workers = ns.workers
+        self.__socket = ns.socket or os.path.join(WORK_FOLDER, SOCKET_NAME)
+        self.__local = ns.local
+        self.__tracer.enabled = ns.metrics is not None
+        self.__check_tables(ns)
+
+        try:
+            self.__run(ns)
+        except VPNError as ex:
+            # служба завершилась или не ответила
+            print(f' {ex._message}', file=sys.stderr)
+        finally:
+            if self.__service:
+                self.__service.close()
+            # Выгрузка длительности этапов и счетчиков
+            if ns.metrics is not None:
+                self.__export_metrics(ns.metrics, ns.metrics_format)
+
+    def __run(self, ns: Namespace) -> None:
+        """ Выполнение команд из аргументов командной строки """
+        # Режим службы
+        if ns.__dict__.get('command') == 'serve':
+            self.__serve(ns.interval, ns.site_intervals or [], ns.timeout)
+            return
         # Вывод списка доступынх vpn серверов в консоль
         if ns.__dict__.get('list', False):
-            self.__print_tables()
+            with self.__tracer.span('list'):
+                self.__print_tables(ns.list_tables or self.__vpn_sites.names(), ns.filters or [],
+                                    ns.sort, ns.limit, ns.format)
         # Обновление списка vpn серверов
         if ns.__dict__.get('update', False):
-            self.__update_tables()
+            with self.__tracer.span('update'):
+                self.__update_tables(ns.timeout, ns.max_age)
+        # Проверка доступности vpn серверов
+        if ns.__dict__.get('command') == 'probe':
+            with self.__tracer.span('probe'):
+                self.__probe(ns.table or self.__vpn_sites.names(), ns.concurrency,
+                             ns.probe_timeout)
+            return
+        # Выгрузка ovpn-файлов
+        if ns.__dict__.get('command') == 'export':
+            if not (ns.all or ns.ranges or ns.export_filters):
+                self.__parser.error('export: one of --index, --filter or --all is required')
+            with self.__tracer.span('export'):
+                self.__export(ns.table or self.__vpn_sites.names(), ns.ranges or [],
+                              ns.export_filters or [], ns.output)
+            return
+        # Подключение к лучшему vpn серверу рейтинга
+        if ns.__dict__.get('best', False):
+            with self.__tracer.span('connect'):
+                self.__connect_best(ns.country, ns.proto, self.__supervisor(ns))
+            return
         # Подключение к выбранному vpn серверу
         if ns.__dict__.get('table', False) and \
             ns.__dict__.get('index', False):
-            self.__connect(ns.table, ns.index)
+            with self.__tracer.span('connect'):
+                self.__connect(ns.table, ns.index, self.__supervisor(ns))
+
+    def __export_metrics(self, path: str, output: Optional[str]) -> None:
+        """ Выгрузка метрик команды и созданных парсеров сайтов
+
+        Args:
+            path (str): путь до файла, "-" - stdout
+            output (Optional[str]): формат выгрузки, по умолчанию -
+                prometheus для файлов *.prom, иначе json
+        """
+        if output is None:
+            output = 'prometheus' if path.endswith('.prom') else 'json'
+        tracers = {'vpnmgr': self.__tracer,
+                   **{key: site.tracer for key, site in self.__vpn_parsers.items()}}
+        try:
+            export(path, output, tracers)
+        except OSError as ex:
+            print(f' Metrics export failed: {ex}', file=sys.stderr)
 
     def __init_conf_dir(self) -> None:
         """ Создание директории с файлами конфигураций vpn серверов """
         if not os.path.isdir(WORK_FOLDER):
             os.mkdir(WORK_FOLDER)
 
+    def __check_tables(self, ns: Namespace) -> None:
+        """ Проверка имен таблиц из аргументов командной строки """
+        tables = ns.list_tables or []
+        if ns.__dict__.get('table'):
+            tables = tables + (ns.table if isinstance(ns.table, list) else [ns.table])
+        unknown = [table for table in tables if table not in self.__vpn_sites]
+        if unknown:
+            self.__parser.error(f'unknown table "{unknown[0]}" '
+                                f'(choose from {", ".join(self.__vpn_sites.names())})')
+
+    def __site(self, key: str) -> AbcSite:
+        """ Парсер сайта, создается при первом обращении """
+        if key not in self.__vpn_parsers:
+            site = self.__vpn_sites.load(key)
+            # сторонние сайты могут не поддерживать настройку загрузки
+            kwargs = {} if self.__workers is None else {'workers': self.__workers}
+            self.__vpn_parsers[key] = site(WORK_FOLDER, **kwargs)
+            self.__vpn_parsers[key].tracer.enabled = self.__tracer.enabled
+        return self.__vpn_parsers[key]
+
+    def __sites(self) -> Dict[str, AbcSite]:
+        """ Парсеры всех сайтов """
+        return {key: self.__site(key) for key in self.__vpn_sites.names()}
+
+    def __service_client(self):
+        """ Соединение с запущенной службой (vpnclient.ServiceClient)
+
+            Модуль клиента импортируется, только если существует сокет службы
+
+        Returns:
+            Optional[ServiceClient]: соединение, None - служба не запущена
+                или отключена флагом --local
+        """
+        if self.__service is None:
+            self.__service = False
+            if not self.__local and os.path.exists(self.__socket):
+                from vpnclient import ServiceClient
+                self.__service = ServiceClient.connect(self.__socket) or False
+        return self.__service or None
+
+    def __serve(self, interval: float, site_intervals: List[Tuple[str, float]],
+                timeout: float) -> None:
+        """ Запуск службы с таблицами всех сайтов в памяти
+
+        Args:
+            interval (float): интервал обновления сайтов (сек.)
+            site_intervals (List[Tuple[str, float]]): интервалы отдельных сайтов
+            timeout (float): срок обновления одного сайта (сек.)
+        """
+        from vpnclient import VPNServiceError
+        from vpnserve import Catalog, serve
+
+        sites = self.__sites()
+        intervals = {key: interval for key in sites}
+        for key, value in site_intervals:
+            if key not in sites:
+                self.__parser.error(f'unknown table "{key}" '
+                                    f'(choose from {", ".join(self.__vpn_sites.names())})')
+            intervals[key] = value
+        try:
+            serve(self.__socket, Catalog(sites, self.__rank, intervals, timeout))
+        except VPNServiceError as ex:
+            print(f' {ex._message}', file=sys.stderr)
+
     def __init_parser(self) -> ArgumentParser:
         """ Инициализация argparse """
-        choices_vpn = self.__vpn_parsers.keys()
-
         parser = ArgumentParser()
         parser.add_argument('--update', '-u', dest='update',
             action='store_true', help='Update the list of VPN servers')
         parser.add_argument('--list', '-l', dest='list',
             action='store_true', help='Print a list of vpn servers')
+        parser.add_argument('--table', dest='list_tables', action='append',
+            type=str, default=None, metavar='TABLE', help='Table for --list (default: all)')
+        parser.add_argument('--filter', dest='filters', action='append', type=parse_filter,
+            default=None, help='Filter for --list: COLUMN(=|!=|<|<=|>|>=|~)VALUE')
+        parser.add_argument('--sort', dest='sort', type=parse_sort, default=None,
+            help='Sort column for --list, "-COLUMN" for descending order')
+        parser.add_argument('--limit', dest='limit', type=int, default=None,
+            help='Maximum rows per table for --list')
+        parser.add_argument('--format', dest='format', choices=FORMATS, default='table',
+            help='Output format for --list')
+        parser.add_argument('--timeout', dest='timeout', type=float, default=UPDATE_TIMEOUT,
+            help='Per-site update deadline in seconds')
+        parser.add_argument('--max-age', dest='max_age', type=float, default=0,
+            help='Skip re-checking sites refreshed less than MAX_AGE seconds ago')
+        parser.add_argument('--workers', dest='workers', type=int, default=None,
+            help='Maximum parallel downloads per site')
+        parser.add_argument('--metrics', dest='metrics', type=str, default=None, metavar='PATH',
+            help='Export phase timings and counters to PATH ("-" for stdout)')
+        parser.add_argument('--metrics-format', dest='metrics_format', choices=METRICS_FORMATS,
+            default=None, help='Metrics format (default: prometheus for *.prom, else json)')
+        parser.add_argument('--socket', dest='socket', type=str, default=None, metavar='PATH',
+            help=f'Service socket (default: {CONF_DIR}/{SOCKET_NAME})')
+        parser.add_argument('--local', dest='local', action='store_true',
+            help='Read the tables directly even if the service is running')
 
         subparser = parser.add_subparsers()
         subparser_connect = subparser.add_parser('connect', help='Connect to VPN server')
         subparser_connect.add_argument('--table', '-t', dest='table',
-            type=str, choices=choices_vpn, default=None, help='Select VPN table')
+            type=str, default=None, metavar='TABLE', help='Select VPN table')
         subparser_connect.add_argument('--index', '-i', dest='index',
             type=int, default=None, help='Vpn server number')
-        
+        subparser_connect.add_argument('--best', '-b', dest='best',
+            action='store_true', help='Connect to the best ranked VPN server')
+        subparser_connect.add_argument('--country', dest='country',
+            type=str, default=None, help='Country filter for --best')
+        subparser_connect.add_argument('--proto', dest='proto',
+            type=str, choices=['udp', 'tcp'], default=None, help='Protocol filter for --best')
+        subparser_connect.add_argument('--openvpn', dest='openvpn',
+            type=str, default=OVPN_BIN, metavar='PATH', help='OpenVPN binary')
+        subparser_connect.add_argument('--connect-timeout', dest='connect_timeout',
+            type=float, default=CONNECT_TIMEOUT, help='Seconds to wait for the tunnel to come up')
+        subparser_connect.add_argument('--attempts', dest='attempts',
+            type=int, default=CONNECT_ATTEMPTS,
+            help='Servers to try, failing over down the ranking on timeout or drop')
+        subparser_connect.add_argument('--race', dest='race',
+            type=int, default=1, metavar='N',
+            help='Start N connection attempts in parallel and keep the first tunnel up')
+
+        subparser_probe = subparser.add_parser('probe',
+            help='Measure latency and reachability of VPN servers')
+        subparser_probe.set_defaults(command='probe')
+        subparser_probe.add_argument('--table', '-t', dest='table', action='append',
+            type=str, default=None, metavar='TABLE', help='Select VPN table (default: all)')
+        subparser_probe.add_argument('--concurrency', '-c', dest='concurrency',
+            type=int, default=None, help='Maximum probes in flight')
+        subparser_probe.add_argument('--probe-timeout', dest='probe_timeout',
+            type=float, default=None, help='Per-probe timeout in seconds')
+
+        subparser_export = subparser.add_parser('export',
+            help='Write the .ovpn files of selected servers to a directory or an archive')
+        subparser_export.set_defaults(command='export')
+        subparser_export.add_argument('--table', '-t', dest='table', action='append',
+            type=str, default=None, metavar='TABLE', help='Select VPN table (default: all)')
+        subparser_export.add_argument('--index', '-i', dest='ranges', type=parse_ranges,
+            default=None, metavar='RANGES', help='Server numbers, e.g. "1-100,250,900-"')
+        subparser_export.add_argument('--filter', dest='export_filters', action='append',
+            type=parse_filter, default=None, metavar='FILTER',
+            help='Filter as for --list: COLUMN(=|!=|<|<=|>|>=|~)VALUE')
+        subparser_export.add_argument('--all', '-a', dest='all', action='store_true',
+            help='Export every server of the selected tables')
+        subparser_export.add_argument('--output', '-o', dest='output', type=str, required=True,
+            metavar='PATH', help='Directory or archive (.zip, .tar, .tar.gz, .tgz, .tar.xz)')
+
+        subparser_serve = subparser.add_parser('serve',
+            help='Keep the tables in memory, refresh them in the background and '
+                 'answer --list and connect over a Unix socket')
+        subparser_serve.set_defaults(command='serve')
+        subparser_serve.add_argument('--interval', dest='interval', type=float,
+            default=SERVE_INTERVAL, help='Refresh interval of every site in seconds')
+        subparser_serve.add_argument('--site-interval', dest='site_intervals', action='append',
+            type=parse_interval, default=None, metavar='TABLE=SECONDS',
+            help='Refresh interval of one site')
+
         return parser
 
-    def __print_tables(self) -> None:
-        """ Вывод таблиц vpn серверов """
-        for key, value in self.__vpn_parsers.items():
-            print(f'Table: {key}')
+    def __print_tables(self, tables: List[str], filters: List[Tuple[str, str, str]],
+                       sort: Optional[Tuple[str, bool]], limit: Optional[int],
+                       output: str) -> None:
+        """ Вывод таблиц vpn серверов построчно, без чтения конфигураций
+
+        Args:
+            tables (List[str]): выводимые таблицы
+            filters (List[Tuple[str, str, str]]): столбец, оператор и значение
+            sort (Optional[Tuple[str, bool]]): столбец и признак сортировки по убыванию
+            limit (Optional[int]): максимальное количество строк каждой таблицы
+            output (str): формат вывода (table, json, csv)
+        """
+        service = self.__service_client()
+        remote: Dict[str, Dict] = {}
+        if service is not None:
+            response = service.request('list', tables=tables, filters=filters, sort=sort,
+                                       limit=limit)
+            remote = {table['name']: table for table in response['tables']}
+
+        with ExitStack() as stack:
+            json_writer = stack.enter_context(JSONWriter(sys.stdout)) if output == 'json' else None
+            for key in tables:
+                try:
+                    if service is not None:
+                        self.__print_remote_table(remote[key], output, json_writer)
+                        continue
+                    site = self.__site(key)
+                    with site.tracer.span('list'):
+                        self.__print_table(
+                            key, output, json_writer,
+                            [(column.key, column.header) for column in site.list_columns()],
+                            lambda: site.select(filters=filters, sort=sort, limit=limit))
+                except VPNFileNotFoundError as ex:
+                    print(f' Config file not found: "{ex._file_path}"\n Use the flag: "--update"', file=sys.stderr)
+                except VPNQueryError as ex:
+                    print(f' Table "{key}": {ex._message}', file=sys.stderr)
+
+    @classmethod
+    def __print_remote_table(cls, table: Dict, output: str,
+                             json_writer: Optional[JSONWriter]) -> None:
+        """ Вывод таблицы, полученной от службы
+
+        Raises:
+            VPNFileNotFoundError, VPNQueryError: ошибка запроса таблицы
+        """
+        from vpnclient import raise_error
+
+        if 'error' in table:
+            raise_error(table['error'])
+        cls.__print_table(table['name'], output, json_writer,
+                          [tuple(column) for column in table['columns']],
+                          lambda: table['rows'])
+
+    @staticmethod
+    def __print_table(key: str, output: str, json_writer: Optional[JSONWriter],
+                      columns: List[Tuple[str, str]],
+                      rows: Callable[[], Iterable[Sequence[Any]]]) -> None:
+        """ Вывод одной таблицы в выбранном формате
+
+        Args:
+            columns (List[Tuple[str, str]]): ключи и заголовки столбцов
+            rows (Callable[[], Iterable[Sequence[Any]]]): функция, возвращающая
+                новый итератор по строкам таблицы
+        """
+        if output == 'table':
+            write_table(sys.stdout, key, [header for _, header in columns], rows)
+        elif output == 'csv':
+            write_csv(sys.stdout, key, [column for column, _ in columns], rows())
+        else:
+            json_writer.write(key, [column for column, _ in columns], rows())
+
+    def __update_tables(self, timeout: float, max_age: float) -> None:
+        """ Параллельное обновление списков vpn серверов
+
+        Args:
+            timeout (float): срок обновления каждого сайта (сек.)
+            max_age (float): время (сек.), в течение которого данные
+                сайта не перепроверяются
+        """
+        summary: Dict[str, Tuple[str, float, int]] = {}
+        results: Dict[str, Tuple[bool, float]] = {}
+        errors: Dict[str, Exception] = {}
+
+        # сайты обновляются в фоновых потоках: поток, не уложившийся в срок,
+        # прерывается и не задерживает завершение программы
+        threads = {key: threading.Thread(target=self.__update_site, daemon=True,
+                                         args=(key, value, max_age, results, errors))
+                   for key, value in self.__sites().items()}
+        start = time.monotonic()
+        for thread in threads.values():
+            thread.start()
+
+        for key, thread in threads.items():
+            site = self.__vpn_parsers[key]
+            thread.join(timeout=max(0.0, start + timeout - time.monotonic()))
+            if thread.is_alive():
+                # результат обновления будет отброшен
+                site.cancel()
+                summary[key] = ('timeout', timeout, site.count())
+            elif key in errors:
+                print(f'Table "{key}": {errors[key]!r}', file=sys.stderr)
+                summary[key] = ('failed', time.monotonic() - start, site.count())
+            else:
+                modified, duration = results[key]
+                summary[key] = ('ok' if modified else 'cached', duration, site.count())
+            for skipped in site.skipped:
+                print(f'Table "{key}": skipped {skipped}', file=sys.stderr)
+
+        print(f'{"Table":<10} {"Status":<8} {"Time (s)":>9} {"Rows":>6} {"Skipped":>7} '
+              f'{"Hits":>5} {"Misses":>6}')
+        for key, (status, duration, rows) in summary.items():
+            site = self.__vpn_parsers[key]
+            hits, misses = site.cache_stats()
+            print(f'{key:<10} {status:<8} {duration:>9.2f} {rows:>6} {len(site.skipped):>7} '
+                  f'{hits:>5} {misses:>6}')
+
+        if any(status == 'ok' for status, _, _ in summary.values()) or not self.__rank.exists():
+            self.__build_rank()
+
+    @staticmethod
+    def __update_site(key: str, site: AbcSite, max_age: float,
+                      results: Dict[str, Tuple[bool, float]],
+                      errors: Dict[str, Exception]) -> None:
+        """ Обновление одного сайта
+
+        Args:
+            results (Dict[str, Tuple[bool, float]]): изменились ли данные сайта
+                и время обновления (сек.)
+            errors (Dict[str, Exception]): ошибка обновления сайта
+        """
+        start = time.monotonic()
+        try:
+            modified = site.refresh(max_age)
+        except Exception as ex:
+            errors[key] = ex
+        else:
+            results[key] = (modified, time.monotonic() - start)
+
+    def __probe(self, tables: List[str], concurrency: Optional[int],
+                timeout: Optional[float]) -> None:
+        """ Проверка доступности и задержки vpn серверов
+
+        Args:
+            tables (List[str]): проверяемые таблицы
+            concurrency (Optional[int]): максимальное количество одновременных проверок
+            timeout (Optional[float]): таймаут одной проверки (сек.)
+        """
+        from vpnprobe import probe_all, DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT
+
+        # адреса vpn серверов каждой таблицы, одинаковые адреса проверяются один раз
+        table_endpoints: Dict[str, Set[Tuple[str, int, str]]] = {}
+        for key in tables:
             try:
-                print(value.table(), end='\n\n')
+                table_endpoints[key] = {endpoint[1:] for endpoint in
+                                        self.__site(key).endpoints()}
             except VPNFileNotFoundError as ex:
                 print(f' Config file not found: "{ex._file_path}"\n Use the flag: "--update"', file=sys.stderr)
-    
-    def __update_tables(self) -> None:
-        """ Обновление списков vpn серверов """
-        for key, value in self.__vpn_parsers.items():
-            print(f'Table "{key}" updated...')
-            try:
-                value.update()
-            except Exception as ex:
-                print(ex.args, file=sys.stderr)
 
-    def __connect(self, table: str, index: int) -> None:
-        """ Подключение к выбранному vpn серверу """
+        endpoints = set().union(*table_endpoints.values())
+        results = probe_all(((endpoint, *endpoint) for endpoint in endpoints),
+                            concurrency or DEFAULT_CONCURRENCY, timeout or DEFAULT_TIMEOUT)
+
+        print(f'{"Table":<10} {"Servers":>7} {"Reachable":>9} {"Median RTT (ms)":>15}')
+        for key, keys in table_endpoints.items():
+            site = self.__site(key)
+            site.save_probes((*endpoint, results[endpoint]) for endpoint in keys)
+
+            rtts = [rtt for rtt in site.probes().values() if rtt is not None]
+            median_rtt = f'{median(rtts):.1f}' if rtts else '-'
+            print(f'{key:<10} {site.count():>7} {len(rtts):>9} {median_rtt:>15}')
+
+        self.__build_rank()
+
+    def __export(self, tables: List[str], ranges: List[Tuple[int, Optional[int]]],
+                 filters: List[Tuple[str, str, str]], path: str) -> None:
+        """ Выгрузка ovpn-файлов выбранных vpn серверов, каждая таблица
+            читается за один проход
+
+        Args:
+            tables (List[str]): выгружаемые таблицы
+            ranges (List[Tuple[int, Optional[int]]]): диапазоны индексов vpn серверов
+            filters (List[Tuple[str, str, str]]): столбец, оператор и значение
+            path (str): директория или архив
+        """
+        from vpnexport import ConfigExporter
+
+        start = time.monotonic()
         try:
-            ovpn_cfg = self.__vpn_parsers[table].get_config(index)
+            with ConfigExporter(path) as exporter:
+                for key in tables:
+                    site = self.__site(key)
+                    try:
+                        with site.tracer.span('export'):
+                            files = exporter.add(key, site.configs(ranges, filters))
+                    except VPNFileNotFoundError as ex:
+                        print(f' Config file not found: "{ex._file_path}"\n Use the flag: "--update"', file=sys.stderr)
+                    except VPNQueryError as ex:
+                        print(f' Table "{key}": {ex._message}', file=sys.stderr)
+                    else:
+                        print(f'Table "{key}": {files} files')
+        except OSError as ex:
+            print(f' Export failed: {ex}', file=sys.stderr)
+            return
+        self.__tracer.count('exported_files', exporter.files)
+        print(f'Exported {exporter.files} files ({exporter.bytes / 1048576:.1f} MB) '
+              f'to "{path}" in {time.monotonic() - start:.2f} s')
+
+    def __build_rank(self) -> None:
+        """ Построение общего рейтинга vpn серверов """
+        rows = self.__rank.build(self.__sites())
+        print(f'Ranking: {rows} servers')
+
+    def __supervisor(self, ns: Namespace):
+        """ Управление процессом openvpn (vpnsupervisor.Supervisor) """
+        from vpnsupervisor import Supervisor
+
+        return Supervisor(ns.openvpn, ns.connect_timeout, ns.attempts, tracer=self.__tracer,
+                          race=ns.race)
+
+    def __ranked(self, country: Optional[str], proto: Optional[str],
+                 limit: int) -> List[RankedServer]:
+        """ Лучшие vpn серверы рейтинга, рейтинг строится при его отсутствии """
+        service = self.__service_client()
+        if service is not None:
+            return [RankedServer(**server) for server in service.request(
+                'best', country=country, proto=proto, limit=limit)['servers']]
+        if not self.__rank.exists():
+            self.__build_rank()
+        return self.__rank.best(country, proto, limit)
+
+    def __connect_best(self, country: str, proto: str, supervisor) -> None:
+        """ Подключение к лучшему vpn серверу рейтинга, при неудаче -
+            к следующим vpn серверам рейтинга
+
+        Args:
+            country (str): фильтр по стране
+            proto (str): фильтр по протоколу
+            supervisor (Supervisor): управление процессом openvpn
+        """
+        servers = self.__ranked(country, proto, supervisor.attempts)
+        if not servers:
+            print(' No VPN server matches the filters', file=sys.stderr)
+            return
+
+        server = servers[0]
+        print(f'Best: {server.table} #{server.index} {server.country} '
+              f'{server.host}:{server.port}/{server.proto} (score {server.score:.1f})')
+        self.__supervise(supervisor, ((self.__label(server), self.__config_getter(server))
+                                      for server in servers))
+
+    def __connect(self, table: str, index: int, supervisor) -> None:
+        """ Подключение к выбранному vpn серверу, при неудаче -
+            к лучшим vpn серверам рейтинга
+
+        Args:
+            table (str): таблица vpn сервера
+            index (int): индекс vpn сервера в таблице
+            supervisor (Supervisor): управление процессом openvpn
+        """
+        ovpn_cfg = self.__config_path(table, index)
+        if ovpn_cfg is None:
+            return
+
+        def failover() -> Iterator[Tuple[str, Callable[[], Optional[str]]]]:
+            for server in self.__ranked(None, None, supervisor.attempts):
+                if (server.table, server.index) != (table, index):
+                    yield self.__label(server), self.__config_getter(server)
+
+        self.__supervise(supervisor, itertools.chain([(f'{table} #{index}', lambda: ovpn_cfg)],
+                                                     failover()))
+
+    @staticmethod
+    def __supervise(supervisor, candidates: Iterable[Tuple[str, Callable[[], Optional[str]]]]
+                    ) -> None:
+        """ Подключение к vpn серверам по очереди до первого работающего туннеля """
+        attempts = supervisor.run(candidates)
+        if not any(attempt.time_to_connect is not None for attempt in attempts):
+            print(f' No VPN server connected after {len(attempts)} attempt(s)', file=sys.stderr)
+
+    @staticmethod
+    def __label(server: RankedServer) -> str:
+        return f'{server.table} #{server.index} {server.host}:{server.port}/{server.proto}'
+
+    def __config_getter(self, server: RankedServer) -> Callable[[], Optional[str]]:
+        return lambda: self.__config_path(server.table, server.index)
+
+    def __config_path(self, table: str, index: int) -> Optional[str]:
+        """ Путь до ovpn-файла vpn сервера
+
+        Returns:
+            Optional[str]: путь до файла, None - таблица или сервер не найдены
+        """
+        service = self.__service_client()
+        try:
+            if service is not None:
+                return service.request('config', table=table, index=index)['path']
+            site = self.__site(table)
+            with site.tracer.span('config'):
+                return site.get_config(index)
         except VPNFileNotFoundError as ex:
             print(f' Config file not found: "{ex._file_path}"\n Use the flag: "--update"', file=sys.stderr)
-        except IndexError as ex:
+        except IndexError:
             print(f' Row "{index}" not found', file=sys.stderr)
-        else:
-            os.system(f'{OVPN_BIN} "{ovpn_cfg}"')
+        return None
 
 def main():
     vm = VPNManager(sys.argv)
@@ -0,0 +1,93 @@
+""" Активная проверка доступности и задержки vpn серверов """
+import os
+import time
+import asyncio
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+# Максимальное количество одновременных проверок
+DEFAULT_CONCURRENCY = 512
+# Таймаут одной проверки (сек.)
+DEFAULT_TIMEOUT = 3.0
+
+def _hard_reset_packet() -> bytes:
+    """ Пакет P_CONTROL_HARD_RESET_CLIENT_V2 без tls-auth:
+        опкод 7 с key_id 0, идентификатор сессии, пустой список
+        подтверждений и идентификатор сообщения 0
+    """
+    return bytes([7 << 3]) + os.urandom(8) + b'\x00' + b'\x00\x00\x00\x00'
+
+class _UDPProbeProtocol(asyncio.DatagramProtocol):
+    """ Ожидание первого ответа vpn сервера """
+    def __init__(self, future: asyncio.Future) -> None:
+        self._future = future
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if not self._future.done():
+            self._future.set_result(data)
+
+    def error_received(self, exc: Exception) -> None:
+        if not self._future.done():
+            self._future.set_exception(exc)
+
+async def probe_tcp(host: str, port: int) -> float:
+    """ Время установки TCP соединения с vpn сервером (мс) """
+    start = time.perf_counter()
+    _, writer = await asyncio.open_connection(host, port)
+    rtt = (time.perf_counter() - start) * 1000
+    writer.close()
+    return rtt
+
+async def probe_udp(host: str, port: int) -> float:
+    """ Время ответа vpn сервера на начало рукопожатия OpenVPN по UDP (мс) """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: _UDPProbeProtocol(future), remote_addr=(host, port))
+    try:
+        start = time.perf_counter()
+        transport.sendto(_hard_reset_packet())
+        await future
+        return (time.perf_counter() - start) * 1000
+    finally:
+        transport.close()
+
+async def _probe(semaphore: asyncio.Semaphore, host: str, port: int,
+                 proto: str, timeout: float) -> Optional[float]:
+    """ Проверка одного vpn сервера
+
+    Returns:
+        Optional[float]: задержка (мс), None - сервер недоступен
+    """
+    probe = probe_tcp if proto == 'tcp' else probe_udp
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(probe(host, port), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+
+async def _probe_all(endpoints: Iterable[Tuple[Hashable, str, int, str]],
+                     concurrency: int, timeout: float) -> Dict[Hashable, Optional[float]]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    keys, tasks = [], []
+    for key, host, port, proto in endpoints:
+        keys.append(key)
+        tasks.append(_probe(semaphore, host, port, proto, timeout))
+    return dict(zip(keys, await asyncio.gather(*tasks)))
+
+def probe_all(endpoints: Iterable[Tuple[Hashable, str, int, str]],
+              concurrency: int = DEFAULT_CONCURRENCY,
+              timeout: float = DEFAULT_TIMEOUT) -> Dict[Hashable, Optional[float]]:
+    """ Параллельная проверка vpn серверов: TCP соединение для tcp,
+        начало рукопожатия OpenVPN для udp
+
+    Args:
+        endpoints (Iterable[Tuple[Hashable, str, int, str]]): ключ, хост,
+            порт и протокол каждого vpn сервера
+        concurrency (int): максимальное количество одновременных проверок
+        timeout (float): таймаут одной проверки (сек.)
+
+    Returns:
+        Dict[Hashable, Optional[float]]: задержка (мс) по ключу vpn сервера,
+            None - сервер недоступен
+    """
+    return asyncio.run(_probe_all(endpoints, concurrency, timeout))
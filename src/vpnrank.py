@@ -0,0 +1,155 @@
+""" Ранжирование vpn серверов всех сайтов """
+import os
+import math
+import sqlite3
+import tempfile
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+from vpnabc import AbcSite, ServerMetrics, VPNFileNotFoundError
+
+class RankedServer(NamedTuple):
+    """ vpn сервер в общем рейтинге """
+    table: str
+    index: int
+    country: str
+    host: str
+    port: int
+    proto: str
+    score: float
+
+def score(metrics: ServerMetrics, proto: str, rtt: Optional[float],
+          stability: Optional[float] = None) -> float:
+    """ Оценка vpn сервера: чем больше, тем лучше
+
+        Учитываются скорость, задержка (измеренная командой probe, иначе
+        указанная на сайте), время работы, протокол и стабильность по истории
+        обновлений. Неизвестные показатели не влияют на оценку
+
+    Args:
+        metrics (ServerMetrics): показатели vpn сервера
+        proto (str): протокол (udp/tcp)
+        rtt (Optional[float]): измеренная задержка (мс)
+        stability (Optional[float]): стабильность (0..1, vpnhistory)
+
+    Returns:
+        float: оценка vpn сервера
+    """
+    result = 0.0
+    if metrics.speed:
+        result += 10 * math.log1p(metrics.speed)
+    latency = rtt if rtt is not None else metrics.ping
+    if latency is not None:
+        result -= latency / 10
+    if metrics.uptime:
+        # не более 10 баллов за 30 дней работы
+        result += min(metrics.uptime / 86400, 30) / 3
+    if stability is not None:
+        # не более 10 баллов, как за время работы: сайт показывает время
+        # с последнего перезапуска, история - наблюдаемое присутствие в списке
+        result += 10 * stability
+    if proto == 'udp':
+        result += 1
+    return result
+
+class RankIndex:
+    """ Общий рейтинг vpn серверов всех таблиц (SQLite)
+
+        Строится после обновления и проверки таблиц, поэтому выбор
+        лучшего сервера не требует чтения таблиц сайтов
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def exists(self) -> bool:
+        """ Построен ли рейтинг """
+        return os.path.isfile(self.path)
+
+    def build(self, sites: Dict[str, AbcSite]) -> int:
+        """ Построение рейтинга по всем таблицам
+
+            Недоступные по результатам probe серверы в рейтинг не попадают
+
+        Args:
+            sites (Dict[str, AbcSite]): сайты по имени таблицы
+
+        Returns:
+            int: количество vpn серверов в рейтинге
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.',
+                                        prefix=f'.{os.path.basename(self.path)}.', suffix='.tmp')
+        os.close(fd)
+        rows = 0
+        try:
+            conn = sqlite3.connect(tmp_path)
+            try:
+                conn.execute('CREATE TABLE ranking (site TEXT NOT NULL, idx INTEGER NOT NULL, '
+                             'country TEXT, host TEXT, port INTEGER, proto TEXT, score REAL)')
+                for key, site in sites.items():
+                    try:
+                        endpoints = {index: (host, port, proto) for index, host, port, proto
+                                     in site.endpoints()}
+                        metrics = list(site.metrics())
+                    except VPNFileNotFoundError:
+                        continue
+                    probes = site.probes((index, *endpoint)
+                                         for index, endpoint in endpoints.items())
+                    stability = site.stability((index, *endpoint)
+                                               for index, endpoint in endpoints.items())
+
+                    for server in metrics:
+                        if server.index not in endpoints:
+                            continue
+                        # сервер недоступен по результатам проверки
+                        if server.index in probes and probes[server.index] is None:
+                            continue
+                        host, port, proto = endpoints[server.index]
+                        conn.execute('INSERT INTO ranking VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                     (key, server.index, server.country, host, port, proto,
+                                      score(server, proto, probes.get(server.index),
+                                            stability.get(server.index))))
+                        rows += 1
+                conn.execute('CREATE INDEX ranking_score ON ranking (proto, score DESC)')
+                conn.commit()
+            finally:
+                conn.close()
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return rows
+
+    def best(self, country: Optional[str] = None, proto: Optional[str] = None,
+             limit: int = 1) -> List[RankedServer]:
+        """ Лучшие vpn серверы рейтинга
+
+        Args:
+            country (Optional[str]): начало названия страны (без учета регистра)
+            proto (Optional[str]): протокол (udp/tcp)
+            limit (int): количество vpn серверов
+
+        Raises:
+            VPNFileNotFoundError: рейтинг не построен
+
+        Returns:
+            List[RankedServer]: vpn серверы по убыванию оценки
+        """
+        if not self.exists():
+            raise VPNFileNotFoundError(self.path)
+
+        query = 'SELECT site, idx, country, host, port, proto, score FROM ranking WHERE 1'
+        args: list = []
+        if country:
+            query += ' AND country LIKE ?'
+            args.append(f'{country}%')
+        if proto:
+            query += ' AND proto = ?'
+            args.append(proto.lower())
+        query += ' ORDER BY score DESC LIMIT ?'
+        args.append(limit)
+
+        conn = sqlite3.connect(f'{Path(self.path).absolute().as_uri()}?mode=ro', uri=True)
+        try:
+            return [RankedServer(*row) for row in conn.execute(query, args)]
+        finally:
+            conn.close()
@@ -0,0 +1,68 @@
+""" Реестр сайтов с vpn серверами
+
+    Модули парсеров (и их зависимости) импортируются только при первом
+    обращении к сайту. Сторонние сайты подключаются через entry points
+    группы "openvpnparser.sites", например в pyproject.toml:
+
+        [project.entry-points."openvpnparser.sites"]
+        example = "vpnexample:VPNExample"
+"""
+import importlib
+from typing import TYPE_CHECKING, Dict, List, Optional, Type
+
+if TYPE_CHECKING:
+    from importlib.metadata import EntryPoint
+    from vpnabc import AbcSite
+
+# Группа entry points сторонних сайтов
+ENTRY_POINT_GROUP = 'openvpnparser.sites'
+
+# Встроенные сайты: имя таблицы и класс парсера ("модуль:класс")
+BUILTIN_SITES = {
+    'vpngate': 'vpngate:VPNGate',
+    'freevpn': 'freevpn:FreeVPN',
+    'ipspeed': 'ipspeed:IPSpeedVPN',
+}
+
+class SiteRegistry:
+    """ Реестр классов парсеров по имени таблицы """
+    def __init__(self, sites: Optional[Dict[str, str]] = None) -> None:
+        self._sites = dict(BUILTIN_SITES if sites is None else sites)
+        self._entry_points: Optional[Dict[str, 'EntryPoint']] = None
+        self._classes: Dict[str, Type['AbcSite']] = {}
+
+    def _discover(self) -> Dict[str, 'EntryPoint']:
+        """ Сторонние сайты, установленные через entry points
+
+            Поиск выполняется один раз и только когда нужен полный
+            список сайтов или имя не найдено среди встроенных
+        """
+        if self._entry_points is None:
+            from importlib.metadata import entry_points
+            self._entry_points = {entry.name: entry for entry in
+                                  entry_points(group=ENTRY_POINT_GROUP)
+                                  if entry.name not in self._sites}
+        return self._entry_points
+
+    def names(self) -> List[str]:
+        """ Имена всех доступных таблиц """
+        return [*self._sites, *self._discover()]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._sites or name in self._discover()
+
+    def load(self, name: str) -> Type['AbcSite']:
+        """ Класс парсера сайта, модуль импортируется при первом обращении
+
+        Raises:
+            KeyError: неизвестное имя таблицы
+        """
+        if name not in self._classes:
+            if name in self._sites:
+                module, _, attr = self._sites[name].partition(':')
+                self._classes[name] = getattr(importlib.import_module(module), attr)
+            elif name in self._discover():
+                self._classes[name] = self._discover()[name].load()
+            else:
+                raise KeyError(name)
+        return self._classes[name]
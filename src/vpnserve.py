@@ -0,0 +1,209 @@
+""" Режим службы: vpnmgr.py serve
+
+    Таблицы всех сайтов читаются из копий в памяти, каждый сайт обновляется
+    в фоне по своему расписанию, а запросы list, best и config принимаются
+    через Unix сокет (протокол описан в vpnclient). Команды vpnmgr.py
+    --list и connect при запущенной службе передают запросы ей
+"""
+import os
+import sys
+import json
+import time
+import signal
+import threading
+import socketserver
+from typing import Any, Dict, List, Optional
+from vpnabc import AbcSite, VPNQueryError
+from vpnrank import RankIndex
+from vpnclient import ServiceClient, VPNServiceError, error_payload
+
+# Интервал обновления сайта по умолчанию (сек.)
+DEFAULT_INTERVAL = 3600
+# Задержка повторного обновления после ошибки (сек.)
+RETRY_INTERVAL = 300
+
+def _log(message: str) -> None:
+    print(f'{time.strftime("%Y-%m-%d %H:%M:%S")} {message}', file=sys.stderr, flush=True)
+
+class Catalog:
+    """ Таблицы vpn серверов всех сайтов в памяти с фоновым обновлением """
+    def __init__(self, sites: Dict[str, AbcSite], rank: RankIndex,
+                 intervals: Dict[str, float], timeout: float) -> None:
+        """
+        Args:
+            sites (Dict[str, AbcSite]): сайты по имени таблицы
+            rank (RankIndex): общий рейтинг vpn серверов
+            intervals (Dict[str, float]): интервал обновления (сек.) по имени таблицы
+            timeout (float): срок обновления одного сайта (сек.)
+        """
+        self._sites = sites
+        self._rank = rank
+        self._intervals = intervals
+        self._timeout = timeout
+        self._stop = threading.Event()
+        self._rank_lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        for site in sites.values():
+            site.load_in_memory()
+
+    def start(self) -> None:
+        """ Запуск фонового обновления сайтов """
+        for key, site in self._sites.items():
+            thread = threading.Thread(target=self._schedule, args=(key, site),
+                                      name=f'update-{key}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """ Остановка обновления: текущие обновления прерываются """
+        self._stop.set()
+        for site in self._sites.values():
+            site.cancel()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _schedule(self, key: str, site: AbcSite) -> None:
+        """ Обновление сайта раз в интервал
+
+            Данные, проверенные не позднее интервала назад (например,
+            перед запуском службы), при запуске не перепроверяются
+        """
+        interval = self._intervals.get(key, DEFAULT_INTERVAL)
+        while not self._stop.is_set():
+            delay = interval
+            timer = threading.Timer(self._timeout, site.cancel)
+            timer.daemon = True
+            timer.start()
+            start = time.monotonic()
+            try:
+                modified = site.refresh(interval)
+            except Exception as ex:
+                _log(f'Table "{key}": update failed: {ex!r}')
+                delay = min(interval, RETRY_INTERVAL)
+            else:
+                _log(f'Table "{key}": {"updated" if modified else "not modified"} in '
+                     f'{time.monotonic() - start:.2f} s, {site.count()} rows')
+                if modified or not self._rank.exists():
+                    self.build_rank()
+            finally:
+                timer.cancel()
+            self._stop.wait(delay)
+
+    def build_rank(self) -> None:
+        """ Построение общего рейтинга vpn серверов """
+        with self._rank_lock:
+            rows = self._rank.build(self._sites)
+        _log(f'Ranking: {rows} servers')
+
+    def _site(self, key: str) -> AbcSite:
+        if key not in self._sites:
+            raise VPNQueryError(f'Unknown table "{key}"')
+        return self._sites[key]
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """ Выполнение запроса клиента
+
+        Returns:
+            Dict[str, Any]: ответ клиенту
+        """
+        try:
+            op = request.get('op')
+            if op == 'ping':
+                return {'ok': True, 'tables': list(self._sites)}
+            if op == 'list':
+                return {'ok': True, 'tables': self._list(
+                    request.get('tables') or list(self._sites),
+                    [tuple(item) for item in request.get('filters') or []],
+                    tuple(request['sort']) if request.get('sort') else None,
+                    request.get('limit'))}
+            if op == 'best':
+                return {'ok': True, 'servers': self._best(
+                    request.get('country'), request.get('proto'), request.get('limit', 1))}
+            if op == 'config':
+                return {'ok': True, 'path': self._site(request['table']).get_config(
+                    int(request['index']))}
+            raise ValueError(f'Unknown operation: "{op}"')
+        except Exception as ex:
+            return {'ok': False, 'error': error_payload(ex)}
+
+    def _list(self, tables: List[str], filters: List[tuple], sort: Optional[tuple],
+              limit: Optional[int]) -> List[Dict[str, Any]]:
+        """ Строки таблиц, ошибка таблицы не прерывает вывод остальных """
+        results = []
+        for key in tables:
+            try:
+                site = self._site(key)
+                with site.tracer.span('list'):
+                    results.append({
+                        'name': key,
+                        'columns': [[column.key, column.header] for column in site.list_columns()],
+                        'rows': [list(row) for row in site.select(filters=filters, sort=sort,
+                                                                  limit=limit)],
+                    })
+            except Exception as ex:
+                results.append({'name': key, 'error': error_payload(ex)})
+        return results
+
+    def _best(self, country: Optional[str], proto: Optional[str],
+              limit: int) -> List[Dict[str, Any]]:
+        if not self._rank.exists():
+            self.build_rank()
+        return [server._asdict() for server in self._rank.best(country, proto, limit)]
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ Запросы одного клиента, по одному JSON объекту на строку """
+    def handle(self) -> None:
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Request must be a JSON object')
+            except ValueError as ex:
+                response = {'ok': False, 'error': error_payload(ex)}
+            else:
+                response = self.server.catalog.handle(request)
+            self.wfile.write(json.dumps(response).encode('utf8') + b'\n')
+            self.wfile.flush()
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, catalog: Catalog) -> None:
+        self.catalog = catalog
+        super().__init__(path, _RequestHandler)
+
+def serve(path: str, catalog: Catalog) -> None:
+    """ Работа службы до сигнала SIGINT или SIGTERM
+
+    Args:
+        path (str): путь до сокета службы
+        catalog (Catalog): таблицы vpn серверов
+
+    Raises:
+        VPNServiceError: служба уже запущена
+    """
+    client = ServiceClient.connect(path)
+    if client is not None:
+        client.close()
+        raise VPNServiceError(f'VPN service is already running: "{path}"')
+    if os.path.exists(path):
+        # сокет остался от завершенной службы
+        os.remove(path)
+
+    server = _Server(path, catalog)
+    os.chmod(path, 0o600)
+    # serve_forever() завершается из другого потока
+    signal.signal(signal.SIGTERM,
+                  lambda signum, frame: threading.Thread(target=server.shutdown).start())
+    catalog.start()
+    _log(f'Serving on "{path}"')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        catalog.stop()
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        _log('Stopped')
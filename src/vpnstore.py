@@ -0,0 +1,537 @@
+""" Хранилище vpn серверов
+
+    Конфигурации хранятся по частям: директивы и встроенные блоки
+    (<ca>, <cert>, <key>, ...) ovpn-файла. Одинаковые части записываются
+    один раз и сжимаются deflate с общим словарем, составленным из первой
+    конфигурации, поэтому ovpn-файлы, отличающиеся только директивами
+    (remote, proto), занимают десятки байт.
+
+    Директивы remote, proto, cipher и auth разбираются при записи и хранятся
+    в индексированных столбцах таблицы servers (DIRECTIVE_COLUMNS), поэтому
+    фильтры по ним не читают конфигурации
+"""
+import os
+import re
+import time
+import zlib
+import struct
+import sqlite3
+import hashlib
+import itertools
+import threading
+from pathlib import Path
+from typing import Any, Collection, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+from vpnconfig import ConfigFields, parse_directives
+from vpnhistory import ServerHistory
+
+# Версия формата хранилища (PRAGMA user_version), хранилище другой
+# версии считается отсутствующим и создается заново при обновлении
+STORE_VERSION = 4
+# Столбцы таблицы servers с директивами ovpn-файла (vpnconfig.ConfigFields)
+DIRECTIVE_COLUMNS = ConfigFields._fields
+# Максимальный размер словаря deflate
+_ZDICT_SIZE = 32768
+# Номера копий хранилищ в памяти (имена баз SQLite в памяти)
+_memory_ids = itertools.count(1)
+# Количество распакованных частей конфигураций в кэше чтения
+_BLOCK_CACHE_SIZE = 1024
+# Открывающий тег встроенного блока ovpn-файла
+_INLINE_TAG_RE = re.compile(rb'<([A-Za-z0-9-]+)>')
+
+def _is_number(value: str) -> bool:
+    """ Является ли строка числом """
+    try:
+        float(value)
+    except ValueError:
+        return False
+    return True
+
+def split_config(config: bytes) -> List[bytes]:
+    """ Разбиение ovpn-файла на директивы и встроенные блоки (<tag>...</tag>)
+
+    Returns:
+        List[bytes]: части ovpn-файла, b''.join() восстанавливает его без изменений
+    """
+    parts, pos, start = [], 0, 0
+    while True:
+        # блок начинается с тега в начале строки
+        if start > 0 or not config.startswith(b'<'):
+            start = config.find(b'\n<', max(start - 1, 0)) + 1
+            if start == 0:
+                break
+        match = _INLINE_TAG_RE.match(config, start)
+        end = -1 if match is None else config.find(b'</' + match.group(1) + b'>', match.end())
+        if end < 0:
+            start += 1
+            continue
+        # блок вместе с переводом строки после закрывающего тега
+        end = config.find(b'\n', end)
+        end = len(config) if end < 0 else end + 1
+        if start > pos:
+            parts.append(config[pos:start])
+        parts.append(config[start:end])
+        pos = start = end
+    if pos < len(config) or not parts:
+        parts.append(config[pos:])
+    return parts
+
+def config_fields(parts: Sequence[bytes]) -> ConfigFields:
+    """ Директивы ovpn-файла по его частям (split_config)
+
+        Разбираются только директивы вне встроенных блоков, весь файл -
+        если remote задана внутри блока (<connection>)
+    """
+    fields = parse_directives(b''.join(part for part in parts if not part.startswith(b'<')))
+    if fields.remote_host is None and len(parts) > 1:
+        fields = parse_directives(b''.join(parts))
+    return fields
+
+def config_digest(config: bytes) -> str:
+    """ Хэш содержимого ovpn-файла """
+    return hashlib.blake2b(config, digest_size=16).hexdigest()
+
+def _pack_ids(ids: Sequence[int]) -> bytes:
+    return struct.pack(f'<{len(ids)}I', *ids)
+
+def _unpack_ids(data: bytes) -> Tuple[int, ...]:
+    return struct.unpack(f'<{len(data) // 4}I', data)
+
+class StoreWriter:
+    """ Запись vpn серверов в новое хранилище """
+    def __init__(self, path: str, columns: Sequence[str]) -> None:
+        self._columns = list(columns)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode = OFF')
+        self._conn.execute('PRAGMA synchronous = OFF')
+        self._conn.execute('DROP TABLE IF EXISTS servers')
+        self._conn.execute('DROP TABLE IF EXISTS configs')
+        self._conn.execute('DROP TABLE IF EXISTS blocks')
+        self._conn.execute('DROP TABLE IF EXISTS meta')
+        columns_sql = ''.join(f', "{name}"' for name in [*self._columns, *DIRECTIVE_COLUMNS])
+        self._conn.execute(f'CREATE TABLE servers (id INTEGER PRIMARY KEY{columns_sql})')
+        # части конфигурации vpn сервера - идентификаторы блоков (uint32 LE),
+        # и хэш ее содержимого
+        self._conn.execute('CREATE TABLE configs (id INTEGER PRIMARY KEY, blocks BLOB NOT NULL, '
+                           'digest TEXT NOT NULL)')
+        self._conn.execute('CREATE TABLE blocks (id INTEGER PRIMARY KEY, data BLOB NOT NULL)')
+        self._conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value BLOB NOT NULL)')
+        self._conn.execute(f'PRAGMA user_version = {STORE_VERSION}')
+        placeholders = ', '.join('?' * (len(self._columns) + len(DIRECTIVE_COLUMNS) + 1))
+        self._insert_server = f'INSERT INTO servers VALUES ({placeholders})'
+        self._rows = 0
+        # идентификаторы записанных блоков по их содержимому
+        self._blocks: Dict[bytes, int] = {}
+        self._zdict: Optional[bytes] = None
+        # объем конфигураций до и после удаления повторов и сжатия
+        self.config_bytes = 0
+        self.stored_bytes = 0
+
+    def add(self, row: Sequence[Any], config: bytes) -> int:
+        """ Добавление vpn сервера
+
+        Args:
+            row (Sequence[Any]): значения столбцов таблицы
+            config (bytes): содержимое ovpn-файла
+
+        Returns:
+            int: индекс vpn сервера в таблице
+        """
+        parts = split_config(config)
+        if self._zdict is None:
+            # словарь из директив первой конфигурации: директивы конфигураций
+            # одного сайта почти совпадают, а встроенные блоки не повторяются
+            # в хранилище и сжимаются без словаря
+            self._zdict = b''.join(part for part in parts
+                                   if not part.startswith(b'<'))[-_ZDICT_SIZE:]
+            self._conn.execute("INSERT INTO meta VALUES ('zdict', ?)", (self._zdict,))
+
+        self._rows += 1
+        self._conn.execute(self._insert_server, (self._rows, *row, *config_fields(parts)))
+        ids = [self._block_id(part) for part in parts]
+        self._conn.execute('INSERT INTO configs VALUES (?, ?, ?)',
+                           (self._rows, _pack_ids(ids), config_digest(config)))
+        self.config_bytes += len(config)
+        self.stored_bytes += 4 * len(ids)
+        return self._rows
+
+    def _block_id(self, part: bytes) -> int:
+        """ Идентификатор части конфигурации, новая часть сжимается и записывается """
+        block_id = self._blocks.get(part)
+        if block_id is None:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=self._zdict)
+            data = compressor.compress(part) + compressor.flush()
+            block_id = len(self._blocks) + 1
+            self._conn.execute('INSERT INTO blocks VALUES (?, ?)', (block_id, data))
+            self._blocks[part] = block_id
+            self.stored_bytes += len(data)
+        return block_id
+
+    @property
+    def rows(self) -> int:
+        """ Количество записанных vpn серверов """
+        return self._rows
+
+    def commit(self) -> None:
+        """ Сохранение записанных данных
+
+            Индексы директив строятся после записи всех строк. Выражения
+            индексов совпадают с условиями ServerStore.select(): строки
+            сравниваются без учета регистра, порт - как число
+        """
+        for name in DIRECTIVE_COLUMNS:
+            expr = f'CAST("{name}" AS REAL)' if name == 'remote_port' else f'lower("{name}")'
+            self._conn.execute(f'CREATE INDEX servers_{name} ON servers ({expr})')
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> 'StoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+class StoreReader:
+    """ Чтение конфигураций vpn серверов с кэшем распакованных частей """
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+        self._zdict: Optional[bytes] = None
+        self._blocks: Dict[int, bytes] = {}
+
+    def _assemble(self, packed: bytes) -> bytes:
+        """ Сборка ovpn-файла из частей по их идентификаторам """
+        ids = _unpack_ids(packed)
+        missing = [block_id for block_id in set(ids) if block_id not in self._blocks]
+        if missing:
+            if self._zdict is None:
+                row = self._conn.execute("SELECT value FROM meta WHERE key = 'zdict'").fetchone()
+                self._zdict = b'' if row is None else row[0]
+            if len(self._blocks) + len(missing) > _BLOCK_CACHE_SIZE:
+                self._blocks.clear()
+                missing = list(set(ids))
+            query = f'SELECT id, data FROM blocks WHERE id IN ({", ".join("?" * len(missing))})'
+            for block_id, data in self._conn.execute(query, missing):
+                decompressor = zlib.decompressobj(-15, zdict=self._zdict)
+                self._blocks[block_id] = decompressor.decompress(data) + decompressor.flush()
+        return b''.join(self._blocks[block_id] for block_id in ids)
+
+    def digest(self, index: int) -> str:
+        """ Хэш конфигурации vpn сервера
+
+        Raises:
+            IndexError: неверный индекс vpn сервера
+        """
+        row = self._conn.execute('SELECT digest FROM configs WHERE id = ?', (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return row[0]
+
+    def config(self, index: int) -> bytes:
+        """ Конфигурация vpn сервера
+
+        Raises:
+            IndexError: неверный индекс vpn сервера
+        """
+        row = self._conn.execute('SELECT blocks FROM configs WHERE id = ?', (index,)).fetchone()
+        if row is None:
+            raise IndexError(index)
+        return self._assemble(row[0])
+
+    def digests(self) -> Iterator[str]:
+        """ Хэши конфигураций всех vpn серверов """
+        for digest, in self._conn.execute('SELECT digest FROM configs'):
+            yield digest
+
+    def configs(self, indexes: Optional[Collection[int]] = None) -> Iterator[Tuple[int, bytes]]:
+        """ Конфигурации vpn серверов в порядке индексов за один проход
+
+        Args:
+            indexes (Optional[Collection[int]]): индексы выбранных vpn серверов,
+                None - все vpn серверы
+        """
+        for index, packed in self._conn.execute('SELECT id, blocks FROM configs ORDER BY id'):
+            if indexes is None or index in indexes:
+                yield index, self._assemble(packed)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> 'StoreReader':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+class ServerStore:
+    """ Хранилище vpn серверов одного сайта (SQLite)
+
+        Столбцы таблицы и конфигурации хранятся раздельно,
+        индекс vpn сервера - первичный ключ обеих таблиц
+    """
+    def __init__(self, path: str, columns: Sequence[str]) -> None:
+        self.path = path
+        self.columns = list(columns)
+        # файл хранилища текущей версии, проверенный exists()
+        self._checked_file: Optional[Tuple[int, int, int]] = None
+        # копия хранилища в памяти (load_in_memory): соединение, которое
+        # удерживает базу в памяти, ее адрес и файл, с которого она снята
+        self._memory_lock: Optional[threading.Lock] = None
+        self._memory_conn: Optional[sqlite3.Connection] = None
+        self._memory_uri: Optional[str] = None
+        self._memory_file: Optional[Tuple[int, int, int]] = None
+
+    def exists(self) -> bool:
+        """ Существует ли хранилище текущей версии формата """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        # версия проверяется один раз для каждого файла хранилища,
+        # обновление заменяет файл целиком
+        file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if self._checked_file == file_id:
+            return True
+
+        conn = self._connect()
+        try:
+            exists = conn.execute('PRAGMA user_version').fetchone()[0] == STORE_VERSION
+        except sqlite3.DatabaseError:
+            exists = False
+        finally:
+            conn.close()
+        self._checked_file = file_id if exists else None
+        return exists
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._memory_lock is not None:
+            conn = self._connect_memory()
+            if conn is not None:
+                return conn
+        return sqlite3.connect(f'{Path(self.path).absolute().as_uri()}?mode=ro', uri=True)
+
+    def load_in_memory(self) -> None:
+        """ Чтение хранилища из копии в памяти
+
+            Файл копируется в разделяемую базу SQLite в памяти при первом
+            чтении и снова - после замены файла обновлением (в том числе
+            другим процессом). Запись нового хранилища не меняется
+        """
+        if self._memory_lock is None:
+            self._memory_lock = threading.Lock()
+
+    def _connect_memory(self) -> Optional[sqlite3.Connection]:
+        """ Соединение с копией хранилища в памяти
+
+        Returns:
+            Optional[sqlite3.Connection]: соединение, None - файла хранилища нет
+        """
+        with self._memory_lock:
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return None
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if self._memory_file != file_id:
+                uri = f'file:vpnstore{next(_memory_ids)}?mode=memory&cache=shared'
+                memory_conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                source = sqlite3.connect(f'{Path(self.path).absolute().as_uri()}?mode=ro',
+                                         uri=True)
+                try:
+                    source.backup(memory_conn)
+                finally:
+                    source.close()
+                # прежняя копия освобождается после закрытия читающих ее соединений
+                if self._memory_conn is not None:
+                    self._memory_conn.close()
+                self._memory_conn, self._memory_uri, self._memory_file = \
+                    memory_conn, uri, file_id
+            return sqlite3.connect(self._memory_uri, uri=True)
+
+    def reader(self) -> 'StoreReader':
+        """ Чтение конфигураций через одно соединение с хранилищем """
+        return StoreReader(self._connect())
+
+    def writer(self, path: Optional[str] = None) -> StoreWriter:
+        """ Создание нового хранилища
+
+        Args:
+            path (Optional[str]): путь для записи, по умолчанию - путь хранилища
+        """
+        return StoreWriter(path or self.path, self.columns)
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        """ Строки таблицы без конфигураций
+
+        Returns:
+            Iterator[Tuple[Any, ...]]: индекс vpn сервера и значения столбцов
+        """
+        columns_sql = ''.join(f', "{name}"' for name in self.columns)
+        conn = self._connect()
+        try:
+            yield from conn.execute(f'SELECT id{columns_sql} FROM servers ORDER BY id')
+        finally:
+            conn.close()
+
+    def select(self, columns: Sequence[str],
+               filters: Sequence[Tuple[str, str, str]] = (),
+               sort: Optional[Tuple[str, bool]] = None,
+               limit: Optional[int] = None) -> Iterator[Tuple[Any, ...]]:
+        """ Выборка столбцов таблицы без чтения конфигураций
+
+        Args:
+            columns (Sequence[str]): SQL выражения выбираемых столбцов
+            filters (Sequence[Tuple[str, str, str]]): выражение, оператор
+                (=, !=, <, <=, >, >=, ~) и значение; числовые значения
+                сравниваются как числа, строки - без учета регистра, ~ - подстрока
+            sort (Optional[Tuple[str, bool]]): выражение и признак сортировки по убыванию
+            limit (Optional[int]): максимальное количество строк
+
+        Returns:
+            Iterator[Tuple[Any, ...]]: значения выбранных столбцов
+        """
+        query = f'SELECT {", ".join(columns)} FROM servers'
+        conditions, args = [], []
+        for expr, op, value in filters:
+            if op == '~':
+                conditions.append(f'instr(lower({expr}), lower(?)) > 0')
+            elif _is_number(value):
+                conditions.append(f'CAST({expr} AS REAL) {op} ?')
+                value = float(value)
+            else:
+                conditions.append(f'lower({expr}) {op} lower(?)')
+            args.append(value)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        if sort is not None:
+            expr, desc = sort
+            order = 'DESC' if desc else 'ASC'
+            # числовые значения сортируются как числа, затем как строки
+            query += f' ORDER BY CAST({expr} AS REAL) {order}, {expr} {order}'
+        else:
+            query += ' ORDER BY id'
+        if limit is not None:
+            query += ' LIMIT ?'
+            args.append(limit)
+
+        conn = self._connect()
+        try:
+            if 'history.' in query:
+                # оценки vpn серверов (vpnhistory.score_expr) - из истории обновлений
+                ServerHistory(self.history_path).attach(conn)
+            yield from conn.execute(query, args)
+        finally:
+            conn.close()
+
+    def config(self, index: int) -> bytes:
+        """ Конфигурация vpn сервера
+
+        Args:
+            index (int): индекс vpn сервера из таблицы
+
+        Raises:
+            IndexError: неверный индекс vpn сервера
+
+        Returns:
+            bytes: содержимое ovpn-файла
+        """
+        with self.reader() as reader:
+            return reader.config(index)
+
+    def config_digest(self, index: int) -> str:
+        """ Хэш конфигурации vpn сервера без ее чтения
+
+        Args:
+            index (int): индекс vpn сервера из таблицы
+
+        Raises:
+            IndexError: неверный индекс vpn сервера
+
+        Returns:
+            str: хэш содержимого ovpn-файла
+        """
+        with self.reader() as reader:
+            return reader.digest(index)
+
+    def digests(self) -> Iterator[str]:
+        """ Хэши конфигураций всех vpn серверов """
+        with self.reader() as reader:
+            yield from reader.digests()
+
+    def configs(self, indexes: Optional[Collection[int]] = None) -> Iterator[Tuple[int, bytes]]:
+        """ Конфигурации vpn серверов за один проход
+
+        Args:
+            indexes (Optional[Collection[int]]): индексы выбранных vpn серверов,
+                None - все vpn серверы
+
+        Returns:
+            Iterator[Tuple[int, bytes]]: индекс vpn сервера и содержимое ovpn-файла
+        """
+        with self.reader() as reader:
+            yield from reader.configs(indexes)
+
+    @property
+    def probes_path(self) -> str:
+        """ Путь до файла с результатами проверки vpn серверов
+
+            Файл хранится рядом с хранилищем и не заменяется при обновлении,
+            результаты привязаны к адресу vpn сервера, а не к индексу
+        """
+        return f'{os.path.splitext(self.path)[0]}.probes.db'
+
+    @property
+    def history_path(self) -> str:
+        """ Путь до истории обновлений таблицы (vpnhistory.ServerHistory),
+            которая, как и результаты проверки, не заменяется при обновлении
+        """
+        return f'{os.path.splitext(self.path)[0]}.history.db'
+
+    def save_probes(self, results: Iterable[Tuple[str, int, str, Optional[float]]]) -> None:
+        """ Сохранение результатов проверки vpn серверов
+
+        Args:
+            results (Iterable[Tuple[str, int, str, Optional[float]]]): хост, порт,
+                протокол и задержка (мс), None - сервер недоступен
+        """
+        checked = time.time()
+        conn = sqlite3.connect(self.probes_path)
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS probes (host TEXT NOT NULL, '
+                             'port INTEGER NOT NULL, proto TEXT NOT NULL, rtt REAL, '
+                             'checked REAL NOT NULL, PRIMARY KEY (host, port, proto))')
+                conn.executemany('INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)',
+                                 ((*endpoint, checked) for endpoint in results))
+        finally:
+            conn.close()
+
+    def probes(self) -> Dict[Tuple[str, int, str], Optional[float]]:
+        """ Результаты последней проверки vpn серверов
+
+        Returns:
+            Dict[Tuple[str, int, str], Optional[float]]: задержка (мс) по хосту,
+                порту и протоколу, None - сервер недоступен
+        """
+        if not os.path.isfile(self.probes_path):
+            return {}
+
+        conn = sqlite3.connect(self.probes_path)
+        try:
+            return {(host, port, proto): rtt for host, port, proto, rtt in
+                    conn.execute('SELECT host, port, proto, rtt FROM probes')}
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        """ Количество vpn серверов """
+        if not self.exists():
+            return 0
+
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM servers').fetchone()[0]
+        finally:
+            conn.close()
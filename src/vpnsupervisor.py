@@ -0,0 +1,243 @@
+""" Управление процессом OpenVPN: ожидание подключения и переключение
+    на следующий vpn сервер
+
+    Состояние туннеля определяется по журналу openvpn (stdout): строка
+    "Initialization Sequence Completed" - туннель поднят, перезапуск
+    соединения (ping-restart, потеря связи) или завершение процесса -
+    туннель потерян. Время до подключения (time-to-connect) учитывается
+    трассировщиком команды.
+
+    В режиме гонки (connect --race N) одновременно запускаются N процессов
+    openvpn, остается первый поднятый туннель. Проигравшие процессы
+    завершаются сразу после подключения победителя и удаляют только свои
+    маршруты (через свои tun-интерфейсы)
+"""
+import sys
+import time
+import queue
+import signal
+import subprocess
+import threading
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, TextIO, Tuple
+from vpntrace import Tracer
+
+# Срок подключения к одному vpn серверу (сек.)
+DEFAULT_CONNECT_TIMEOUT = 30
+# Количество vpn серверов, к которым пытается подключиться команда
+DEFAULT_ATTEMPTS = 3
+# Срок завершения openvpn после SIGTERM (сек.)
+STOP_TIMEOUT = 5
+
+# Туннель поднят
+CONNECTED_MARKERS = ('Initialization Sequence Completed',)
+# Соединение перезапускается или не может быть установлено
+# (при фатальной ошибке openvpn завершается сам)
+DROPPED_MARKERS = ('SIGUSR1[soft,', 'SIGHUP[', 'Inactivity timeout', 'AUTH_FAILED',
+                   'Connection reset, restarting')
+
+class Attempt(NamedTuple):
+    """ Результат подключения к одному vpn серверу """
+    label: str
+    # время до подключения (сек.), None - туннель не поднят
+    time_to_connect: Optional[float]
+    # причина завершения: timeout, dropped, exited, interrupted, no config,
+    # not started (openvpn не запускается), cancelled (подключение к другому
+    # vpn серверу выполнено раньше)
+    reason: str
+
+class Tunnel:
+    """ Процесс openvpn с одним ovpn-файлом
+
+        Журнал процесса читается в отдельном потоке и выводится в output,
+        изменения состояния туннеля передаются в общую очередь events
+        кортежами (туннель, состояние, время): connected - туннель поднят,
+        dropped - соединение перезапускается, exited - процесс завершился
+    """
+    def __init__(self, command: Sequence[str], events: 'queue.Queue[Event]',
+                 output: Optional[TextIO] = None, prefix: str = '') -> None:
+        self._events = events
+        self._output = output
+        self._prefix = prefix
+        self.started = time.monotonic()
+        self._process = subprocess.Popen(command, stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         text=True, errors='replace', bufsize=1)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self) -> None:
+        connected = False
+        for line in self._process.stdout:
+            if self._output is not None:
+                self._output.write(self._prefix + line)
+                self._output.flush()
+            if not connected and any(marker in line for marker in CONNECTED_MARKERS):
+                connected = True
+                self._events.put((self, 'connected', time.monotonic()))
+            elif any(marker in line for marker in DROPPED_MARKERS):
+                self._events.put((self, 'dropped', time.monotonic()))
+        # конец журнала - процесс завершается
+        self._events.put((self, 'exited', time.monotonic()))
+
+    def stop(self) -> Optional[int]:
+        """ Завершение openvpn: SIGTERM, затем SIGKILL (по истечении срока
+            или повторному Ctrl+C)
+
+        Returns:
+            Optional[int]: код завершения процесса
+        """
+        if self._process.poll() is None:
+            self._process.send_signal(signal.SIGTERM)
+            try:
+                self._process.wait(timeout=STOP_TIMEOUT)
+            except (subprocess.TimeoutExpired, KeyboardInterrupt):
+                self._process.kill()
+                self._process.wait()
+        self._reader.join(timeout=STOP_TIMEOUT)
+        return self._process.returncode
+
+# Изменение состояния туннеля: туннель, состояние, время (time.monotonic)
+Event = Tuple[Tunnel, str, float]
+
+class Supervisor:
+    """ Подключение к vpn серверам до первого работающего туннеля
+
+        Одновременно запускается до race процессов openvpn (happy eyeballs):
+        первый поднятый туннель остается, остальные завершаются. Если туннель
+        не поднят за отведенный срок или потерян, openvpn завершается и
+        запускается следующий vpn сервер
+    """
+    def __init__(self, binary: str, connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 attempts: int = DEFAULT_ATTEMPTS, output: Optional[TextIO] = sys.stdout,
+                 tracer: Optional[Tracer] = None, race: int = 1) -> None:
+        """
+        Args:
+            binary (str): путь до openvpn
+            connect_timeout (float): срок подключения к одному vpn серверу (сек.)
+            attempts (int): максимальное количество vpn серверов, не меньше race
+            output (Optional[TextIO]): вывод журнала openvpn, None - не выводится
+            tracer (Optional[Tracer]): трассировщик команды: time_to_connect,
+                счетчики connect_attempts и failovers
+            race (int): количество одновременных подключений
+        """
+        self._binary = binary
+        self._connect_timeout = connect_timeout
+        self.race = max(1, race)
+        # максимальное количество vpn серверов
+        self.attempts = max(1, attempts, self.race)
+        self._output = output
+        self._tracer = tracer or Tracer()
+
+    def run(self, candidates: Iterable[Tuple[str, Callable[[], Optional[str]]]]) -> List[Attempt]:
+        """ Подключение к vpn серверам
+
+            Работающий туннель удерживается до его потери или прерывания (Ctrl+C)
+
+        Args:
+            candidates (Iterable[Tuple[str, Callable[[], Optional[str]]]]): описание
+                vpn сервера и функция, возвращающая путь до его ovpn-файла
+                (None - конфигурация недоступна), в порядке предпочтения
+
+        Returns:
+            List[Attempt]: результаты подключений в порядке завершения
+        """
+        attempts: List[Attempt] = []
+        events: 'queue.Queue[Event]' = queue.Queue()
+        # запущенные туннели: описание vpn сервера и срок подключения
+        pending: Dict[Tunnel, Tuple[str, float]] = {}
+        # время до подключения поднятого туннеля
+        connected: Dict[Tunnel, float] = {}
+        candidates = iter(candidates)
+        started = 0
+        try:
+            while True:
+                while len(pending) < self.race and started < self.attempts:
+                    candidate = next(candidates, None)
+                    if candidate is None:
+                        break
+                    started += 1
+                    if attempts:
+                        self._tracer.count('failovers')
+                    tunnel = self._start(candidate, events, attempts)
+                    if tunnel is None:
+                        if attempts[-1].reason == 'not started':
+                            return attempts
+                        continue
+                    pending[tunnel] = (candidate[0], tunnel.started + self._connect_timeout)
+                if not pending:
+                    return attempts
+
+                deadline = min(deadline for _, deadline in pending.values())
+                try:
+                    tunnel, state, at = events.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    now = time.monotonic()
+                    for tunnel, (label, deadline) in list(pending.items()):
+                        if deadline <= now:
+                            self._finish(pending, tunnel, None, 'timeout', attempts)
+                    continue
+                if tunnel not in pending:
+                    # событие остановленного туннеля
+                    continue
+                if state != 'connected':
+                    self._finish(pending, tunnel, None, state, attempts)
+                    continue
+
+                label, _ = pending[tunnel]
+                time_to_connect = connected[tunnel] = at - tunnel.started
+                for other in list(pending):
+                    if other is not tunnel:
+                        self._finish(pending, other, None, 'cancelled', attempts)
+                self._tracer.add_time('time_to_connect', time_to_connect)
+                print(f'Connected: {label} in {time_to_connect:.2f} s', file=sys.stderr)
+                state = self._hold(tunnel, events)
+                print(f' {label}: connection lost ({state})', file=sys.stderr)
+                self._finish(pending, tunnel, time_to_connect, state, attempts)
+        except KeyboardInterrupt:
+            for tunnel in list(pending):
+                self._finish(pending, tunnel, connected.get(tunnel), 'interrupted', attempts)
+            return attempts
+
+    def _start(self, candidate: Tuple[str, Callable[[], Optional[str]]],
+               events: 'queue.Queue[Event]', attempts: List[Attempt]) -> Optional[Tunnel]:
+        """ Запуск openvpn для vpn сервера
+
+        Returns:
+            Optional[Tunnel]: туннель, None - результат добавлен в attempts
+        """
+        label, config = candidate
+        path = config()
+        if path is None:
+            attempts.append(Attempt(label, None, 'no config'))
+            return None
+        self._tracer.count('connect_attempts')
+        print(f'Connecting: {label}', file=sys.stderr)
+        try:
+            return Tunnel([self._binary, '--config', path], events, self._output,
+                          f'[{label}] ' if self.race > 1 else '')
+        except OSError as ex:
+            print(f' Failed to start "{self._binary}": {ex}', file=sys.stderr)
+            attempts.append(Attempt(label, None, 'not started'))
+            return None
+
+    @staticmethod
+    def _hold(tunnel: Tunnel, events: 'queue.Queue[Event]') -> str:
+        """ Ожидание потери туннеля
+
+        Returns:
+            str: dropped - соединение перезапускается, exited - процесс завершился
+        """
+        while True:
+            source, state, _ = events.get()
+            if source is tunnel and state != 'connected':
+                return state
+
+    @staticmethod
+    def _finish(pending: Dict[Tunnel, Tuple[str, float]], tunnel: Tunnel,
+                time_to_connect: Optional[float], reason: str, attempts: List[Attempt]) -> None:
+        """ Завершение openvpn и запись результата подключения """
+        label, _ = pending.pop(tunnel)
+        if time_to_connect is None and reason not in ('cancelled', 'interrupted'):
+            print(f' {label}: not connected ({reason})', file=sys.stderr)
+        tunnel.stop()
+        attempts.append(Attempt(label, time_to_connect, reason))
@@ -0,0 +1,121 @@
+""" Инструментирование: длительность этапов работы сайтов и счетчики
+
+    Этапы (fetch, parse, decode, write, ...) и счетчики (requests, bytes,
+    rows) собираются только при включенном трассировщике (флаг --metrics)
+    и выгружаются в JSON или в текстовый файл Prometheus (node exporter,
+    textfile collector)
+"""
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import ContextManager, Dict, Iterator, Mapping, TextIO
+
+# Доступные форматы выгрузки
+FORMATS = ('json', 'prometheus')
+# Префикс имен метрик Prometheus
+PROMETHEUS_PREFIX = 'vpnmgr'
+
+class Tracer:
+    """ Длительность этапов и счетчики одного сайта (или команды) """
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # этап: количество вызовов и суммарная длительность (сек.)
+        self._spans: Dict[str, Dict[str, float]] = {}
+        self._counters: Dict[str, float] = {}
+
+    def span(self, phase: str) -> ContextManager[None]:
+        """ Замер длительности этапа, вызовы одного этапа суммируются """
+        if not self.enabled:
+            return nullcontext()
+        return self._span(phase)
+
+    @contextmanager
+    def _span(self, phase: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, time.perf_counter() - start)
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """ Учет длительности этапа, измеренной вне span() """
+        if not self.enabled:
+            return
+        with self._lock:
+            span = self._spans.setdefault(phase, {'count': 0, 'seconds': 0.0})
+            span['count'] += 1
+            span['seconds'] += seconds
+
+    def count(self, name: str, value: float = 1) -> None:
+        """ Увеличение счетчика (запросы, байты, строки) """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """ Текущие значения этапов и счетчиков """
+        with self._lock:
+            return {'spans': {phase: dict(span) for phase, span in self._spans.items()},
+                    'counters': dict(self._counters)}
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def write_json(stream: TextIO, tracers: Mapping[str, Tracer]) -> None:
+    """ Выгрузка в JSON: объект с этапами и счетчиками по имени сайта """
+    json.dump({name: tracer.snapshot() for name, tracer in tracers.items()},
+              stream, indent=2)
+    stream.write('\n')
+
+def write_prometheus(stream: TextIO, tracers: Mapping[str, Tracer]) -> None:
+    """ Выгрузка в текстовом формате Prometheus
+
+        Значения относятся к последнему запуску, поэтому метрики имеют тип gauge
+    """
+    snapshots = {name: tracer.snapshot() for name, tracer in tracers.items()}
+    metrics = [
+        ('phase_seconds', 'Time spent in a phase during the last run', 'seconds'),
+        ('phase_calls', 'Number of times a phase ran during the last run', 'count'),
+    ]
+    for suffix, help_text, field in metrics:
+        name = f'{PROMETHEUS_PREFIX}_{suffix}'
+        stream.write(f'# HELP {name} {help_text}\n# TYPE {name} gauge\n')
+        for site, snapshot in snapshots.items():
+            for phase, span in sorted(snapshot['spans'].items()):
+                stream.write(f'{name}{{site="{_escape(site)}",phase="{_escape(phase)}"}} '
+                             f'{span[field]}\n')
+
+    counters = sorted({counter for snapshot in snapshots.values()
+                       for counter in snapshot['counters']})
+    for counter in counters:
+        name = f'{PROMETHEUS_PREFIX}_{counter}'
+        stream.write(f'# HELP {name} Value of "{counter}" during the last run\n'
+                     f'# TYPE {name} gauge\n')
+        for site, snapshot in snapshots.items():
+            if counter in snapshot['counters']:
+                stream.write(f'{name}{{site="{_escape(site)}"}} {snapshot["counters"][counter]}\n')
+
+def export(path: str, output: str, tracers: Mapping[str, Tracer]) -> None:
+    """ Выгрузка метрик в файл или в stdout ("-")
+
+        Файл заменяется атомарно, чтобы node exporter не прочитал его частично
+
+    Args:
+        path (str): путь до файла или "-"
+        output (str): формат выгрузки (json, prometheus)
+        tracers (Mapping[str, Tracer]): трассировщики по имени сайта
+    """
+    write = write_json if output == 'json' else write_prometheus
+    if path == '-':
+        write(sys.stdout, tracers)
+        return
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as file:
+        write(file, tracers)
+    os.replace(tmp_path, path)